@@ -15,8 +15,14 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import os
+import re
+import json
+import time
+import hashlib
+import codecs
 import threading
-import subprocess
+
+from collections import namedtuple
 
 import sublime, sublime_plugin
 
@@ -28,131 +34,847 @@ PANEL_ID = "DreamMaker Build"
 
 # Based on https://www.sublimetext.com/docs/3/build_systems.html
 class DreammakerBuildCommand(sublime_plugin.WindowCommand):
-	encoding = 'utf-8'
-	killed = False
-	proc = None
-	panel = None
-	panel_lock = threading.Lock()
+	def __init__(self, window):
+		super().__init__(window)
+		self.jobs = []
+		self.pool = None
 
-	def is_enabled(self, kill=False):
+	def is_enabled(self, kill=False, force=False, all_environments=False, background=False):
 		# Kill option only available when running.
 		if kill:
-			return self.proc is not None and self.proc.poll() is None
+			return any(job.is_running() and (job.background or not background) for job in self.jobs)
 		return True
 
-	def run(self, kill=False):
+	# With `background`, the build is one started by watch mode, which only
+	# ever replaces other watch mode builds.
+	def run(self, kill=False, force=False, all_environments=False, background=False):
 		if kill:
-			if self.proc:
-				self.killed = True
-				self.proc.terminate()
+			if not background or all(job.background for job in self.jobs):
+				self.stop()
+			return
+		if background and any(not (job.background or job.done or job.killed) for job in self.jobs):
 			return
 
 		vars = self.window.extract_variables()
 		working_dir = vars['folder']
 
-		exe = utils.find_byond_file(["bin/dm.exe", "bin/DreamMaker"])
+		from .language_client import LspDreammakerPlugin
+		instance = LspDreammakerPlugin.instances.get(self.window.id())
+		if background:
+			# Builds on save stay quiet rather than popping up dialogs.
+			if not instance or not instance.environment_file or not utils.get_config('byondPath'):
+				return
+			all_environments = False
+
+		exe = utils.find_byond_file(["bin/dm.exe", "bin/DreamMaker"], executable=True)
 		if exe is None:
+			if background:
+				return
 			sublime.error_message('You must configure "byondPath" to point to a valid BYOND installation.')
 			utils.open_config()
 			return
 
-		from .language_client import LspDreammakerPlugin
-		instance = LspDreammakerPlugin.instances.get(self.window.id())
-		if not instance:
-			sublime.error_message('Start the language server by opening a .dm file.')
+		if all_environments:
+			environments = utils.get_config('buildEnvironments')
+			if not environments:
+				sublime.error_message('List the .dme files to build in "buildEnvironments".')
+				utils.open_config()
+				return
+		else:
+			if not instance:
+				sublime.error_message('Start the language server by opening a .dm file.')
+				return
+			if not instance.environment_file:
+				sublime.error_message('No DME detected by the language server.')
+				return
+			environments = [instance.environment_file]
+
+		self.stop()
+		# Their panels are about to be reused by the new build.
+		if self.pool:
+			self.pool.superseded = True
+		for job in self.jobs:
+			job.superseded = True
+
+		previous = BuildResults.by_window.get(self.window.id())
+		if previous:
+			previous.clear_markers()
+		results = BuildResults(self.window)
+		BuildResults.by_window[self.window.id()] = results
+
+		self.jobs = []
+		for dme in environments:
+			dme_path = os.path.join(working_dir, dme)
+			if all_environments:
+				panel_name = "{}: {}".format(PANEL_ID, os.path.basename(dme))
+			else:
+				panel_name = PANEL_ID
+			job = BuildJob(self.window, panel_name, exe, dme_path, results, force, background)
+			if instance and instance.client and dme == instance.environment_file:
+				job.client = instance.client
+			self.jobs.append(job)
+
+		if all_environments:
+			self.pool = BuildPool(self.window, self.jobs)
+			self.pool.start()
+		else:
+			self.pool = None
+			self.jobs[0].create_panel(not background)
+			if background:
+				self.jobs[0].on_finish = self.on_background_finish
+			self.jobs[0].start()
+
+	def on_background_finish(self, job):
+		if job.killed:
+			return
+		def report():
+			self.window.status_message('DreamMaker: {}: {}'.format(job.name, job.outcome()))
+			if not job.success:
+				self.window.run_command('show_panel', {'panel': 'output.{}'.format(job.panel_name)})
+		sublime.set_timeout(report, 0)
+
+	def stop(self):
+		if self.pool:
+			self.pool.cancel()
+		for job in self.jobs:
+			job.kill()
+
+
+# Runs several builds at once, at most one per CPU core, and then writes a
+# pass/fail summary to the main build panel.
+class BuildPool:
+	def __init__(self, window, jobs):
+		self.window = window
+		self.jobs = jobs
+		self.queue = list(jobs)
+		self.running = 0
+		import multiprocessing
+		self.limit = max(1, multiprocessing.cpu_count())
+		self.lock = threading.Lock()
+		self.cancelled = False
+		self.superseded = False
+
+	def start(self):
+		self.summary = self.window.create_output_panel(PANEL_ID)
+		self.window.run_command('show_panel', {'panel': 'output.{}'.format(PANEL_ID)})
+		self.write('-- Building {} environments, {} at a time\n'.format(len(self.jobs), min(self.limit, len(self.jobs))))
+		for job in self.jobs:
+			job.create_panel(False)
+			job.on_finish = self.on_finish
+		self.start_next()
+
+	def start_next(self):
+		with self.lock:
+			ready = []
+			while self.queue and self.running < self.limit and not self.cancelled:
+				ready.append(self.queue.pop(0))
+				self.running += 1
+		for job in ready:
+			job.start()
+
+	def on_finish(self, job):
+		with self.lock:
+			self.running -= 1
+			done = not self.queue and not self.running
+		sublime.set_timeout(lambda: self.write('{}: {}\n'.format(job.name, job.outcome())), 0)
+		if done:
+			sublime.set_timeout(self.finish, 0)
+		else:
+			self.start_next()
+
+	def finish(self):
+		if self.superseded:
 			return
-		dme = instance.environment_file
-		if not dme:
-			sublime.error_message('No DME detected by the language server.')
+		passed = sum(1 for job in self.jobs if job.success)
+		if self.cancelled:
+			summary = 'Cancelled'
+		elif passed == len(self.jobs):
+			summary = 'All {} environments built'.format(passed)
+		else:
+			summary = '{} of {} environments failed'.format(len(self.jobs) - passed, len(self.jobs))
+		self.write('-- {}'.format(summary))
+		self.window.status_message('DreamMaker: {}'.format(summary))
+
+	def cancel(self):
+		with self.lock:
+			self.cancelled = True
+			del self.queue[:]
+
+	def write(self, text):
+		if self.superseded:
 			return
+		self.summary.run_command('append', {'characters': text})
 
-		with self.panel_lock:
-			self.panel = self.window.create_output_panel(PANEL_ID)
 
-			settings = self.panel.settings()
-			settings.set(
-				'result_file_regex',
-				"^([^:]+):(\\d+):([^:]+): (.*)$"
-			)
-			settings.set('result_base_dir', working_dir)
+# A single compile of one .dme, with its own output panel.
+class BuildJob:
+	FLUSH_INTERVAL = 50
+
+	def __init__(self, window, panel_name, exe, dme_path, results, force, background=False):
+		self.window = window
+		self.panel_name = panel_name
+		self.exe = exe
+		self.dme_path = dme_path
+		self.name = os.path.basename(dme_path)
+		self.working_dir = os.path.dirname(dme_path)
+		self.results = results
+		self.force = force
+		self.background = background
+		self.encoding = utils.get_config('buildEncoding') or 'utf-8'
+		self.client = None
+		self.on_finish = None
 
-			self.window.run_command('show_panel', {'panel': 'output.{}'.format(PANEL_ID)})
+		self.panel = None
+		self.proc = None
+		self.killed = False
+		self.superseded = False
+		self.done = False
+		self.success = False
+		self.returncode = None
+		self.pending = []
+		self.pending_lock = threading.Lock()
+		self.flush_scheduled = False
 
+	def create_panel(self, show):
+		self.panel = self.window.create_output_panel(self.panel_name)
+
+		settings = self.panel.settings()
+		settings.set(
+			'result_file_regex',
+			"^([^:]+):(\\d+):([^:]+): (.*)$"
+		)
+		settings.set('result_base_dir', self.working_dir)
+
+		if show:
+			self.window.run_command('show_panel', {'panel': 'output.{}'.format(self.panel_name)})
+
+	def is_running(self):
+		return self.proc is not None and self.proc.poll() is None
+
+	def kill(self):
+		self.killed = True
 		if self.proc is not None:
 			try:
 				self.proc.terminate()
 			except ProcessLookupError:
 				pass
-			self.proc = None
 
+	def outcome(self):
+		if self.killed:
+			return 'cancelled'
+		elif self.success:
+			return 'ok'
+		elif self.returncode is None:
+			return 'FAILED (could not run the compiler)'
+		return 'FAILED (exit code {})'.format(self.returncode)
+
+	def start(self):
+		threading.Thread(target=self.check_cache).start()
+
+	def check_cache(self):
 		try:
-			from LSP.plugin.core.protocol import Notification
-			from . import language_client
-		except ImportError as e:
-			print("not issuing reparse to langserver:", e)
+			cache = BuildCache(self.dme_path, self.exe)
+			cache.compute()
+			cached = not self.force and cache.up_to_date()
+		except Exception as e:
+			# Whatever is wrong with the manifest, compiling still works.
+			print("dreammaker build: not caching:", e)
+			cache, cached = None, False
+
+		if cached:
+			self.results.stream(self.working_dir).feed(cache.output, final=True)
+			self.queue_write('-- {} is up to date\n'.format(os.path.basename(cache.dmb_path)))
+			self.queue_write(cache.output)
+			self.queue_write('-- Finished (cached)')
+			try:
+				cache.save(cache.output)
+			except OSError as e:
+				print("dreammaker build: failed to save cache:", e)
+			self.finished(True)
+			return
+
+		sublime.set_timeout(lambda: self.launch(cache), 0)
+
+	def launch(self, cache):
+		if self.killed:
+			self.finished(False)
+			return
+
+		if self.client:
+			try:
+				from LSP.plugin.core.protocol import Notification
+				from . import language_client
+			except ImportError as e:
+				print("not issuing reparse to langserver:", e)
+			else:
+				self.client.send_notification(Notification("experimental/dreammaker/reparse"))
+
+		install = utils.byond_install_of(self.exe)
+		if install and install.wine_prefix:
+			# Found in a Wine prefix rather than configured directly.
+			args = [install.wine, self.exe, self.name]
+			env = dict(os.environ, WINEPREFIX=install.wine_prefix)
 		else:
-			if instance.client:
-				instance.client.send_notification(Notification("experimental/dreammaker/reparse"))
+			args = [self.exe, self.name]
+			env = {}
+			if sublime.platform() != 'windows':
+				env['LD_LIBRARY_PATH'] = os.path.split(self.exe)[0]
 
-		args = [exe, dme]
-		env = {}
-		if sublime.platform() != 'windows':
-			env['LD_LIBRARY_PATH'] = os.path.split(exe)[0]
+		# Disable console popup on Windows
+		creationflags = 0x8000000 if sublime.platform() == "windows" else 0
+		preexec_fn = None
+		if self.background:
+			# Leave the CPU to the editor and the language server.
+			if sublime.platform() == "windows":
+				creationflags |= BELOW_NORMAL_PRIORITY_CLASS
+			else:
+				preexec_fn = lower_priority
 
 		self.do_write('-- {}\n'.format(' '.join(args)))
-		self.proc = subprocess.Popen(
-			args,
-			stdout=subprocess.PIPE,
-			stderr=subprocess.STDOUT,
-			cwd=working_dir,
-			env=env,
-			# Disable console popup on Windows
-			creationflags=0x8000000 if sublime.platform() == "windows" else 0,
-		)
-		self.killed = False
+		import subprocess
+		self.timings = BuildTimings(self.dme_path)
+		try:
+			self.proc = subprocess.Popen(
+				args,
+				stdout=subprocess.PIPE,
+				stderr=subprocess.STDOUT,
+				cwd=self.working_dir,
+				env=env,
+				creationflags=creationflags,
+				preexec_fn=preexec_fn,
+			)
+		except (OSError, subprocess.SubprocessError) as e:
+			self.do_write('-- Failed to run the compiler: {}'.format(e))
+			self.finished(False)
+			return
 
 		threading.Thread(
 			target=self.read_handle,
-			args=(self.proc.stdout,)
+			args=(cache,)
 		).start()
 
-	def read_handle(self, handle):
-		chunk_size = 2 ** 13
-		out = b''
-		while True:
+	def read_handle(self, cache):
+		stream = self.results.stream(self.working_dir, self.timings)
+		output = []
+		for text, final in read_output(self.proc.stdout.fileno(), self.encoding):
+			stream.feed(text, final=final)
+			if text:
+				output.append(text)
+				self.queue_write(text)
+
+		self.returncode = self.timings.wait(self.proc)
+		if self.killed:
+			self.queue_write('-- Cancelled')
+		else:
+			self.queue_write('-- Finished {}'.format(self.timings.describe()))
+			self.timings.record(self.returncode == 0)
+
+		# Only a complete, successful build may be reused later.
+		success = self.returncode == 0 and not self.killed
+		if success and cache:
 			try:
-				data = os.read(handle.fileno(), chunk_size)
-				# If exactly the requested number of bytes was
-				# read, there may be more data, and the current
-				# data may contain part of a multibyte char
-				out += data
-				if len(data) == chunk_size:
-					continue
-				if data == b'' and out == b'':
-					raise IOError('EOF')
-				# We pass out to a function to ensure the
-				# timeout gets the value of out right now,
-				# rather than a future (mutated) version
-				self.queue_write(out.decode(self.encoding))
-				if data == b'':
-					raise IOError('EOF')
-				out = b''
-			except (UnicodeDecodeError) as e:
-				msg = 'Error decoding output using %s - %s'
-				self.queue_write(msg  % (self.encoding, str(e)))
-				break
-			except (IOError):
-				if self.killed:
-					msg = 'Cancelled'
-				else:
-					msg = 'Finished'
-				self.queue_write('-- %s' % msg)
-				break
+				cache.save("".join(output))
+			except OSError as e:
+				print("dreammaker build: failed to save cache:", e)
+		self.finished(success)
+
+	def finished(self, success):
+		self.success = success
+		self.done = True
+		if self.on_finish:
+			self.on_finish(self)
 
+	# Output is coalesced so that the panel sees at most one append per
+	# FLUSH_INTERVAL milliseconds, no matter how chatty the compiler is.
 	def queue_write(self, text):
-		sublime.set_timeout(lambda: self.do_write(text), 1)
+		with self.pending_lock:
+			self.pending.append(text)
+			if self.flush_scheduled:
+				return
+			self.flush_scheduled = True
+		sublime.set_timeout(self.flush_writes, self.FLUSH_INTERVAL)
+
+	def flush_writes(self):
+		with self.pending_lock:
+			text = "".join(self.pending)
+			del self.pending[:]
+			self.flush_scheduled = False
+		if text:
+			self.do_write(text)
+		# A replaced build's late output mustn't bring back its markers.
+		if not self.superseded:
+			self.results.update_markers()
 
 	def do_write(self, text):
+		if self.superseded:
+			return
 		text = text.replace('\r', '')  # for Wine
-		with self.panel_lock:
-			self.panel.run_command('append', {'characters': text})
+		self.panel.run_command('append', {'characters': text})
+
+
+BELOW_NORMAL_PRIORITY_CLASS = 0x4000
+
+
+def lower_priority():
+	os.nice(10)
+
+
+# Watch mode: saving a tickable file rebuilds the current environment in the
+# background. A burst of saves only builds once, after the last of them, and
+# a save kills any watch mode build which is already running, as it is out of
+# date. Builds started by hand are left alone.
+class BuildOnSaveEventListener(sublime_plugin.EventListener):
+	DEBOUNCE = 1000  # milliseconds
+	generation = {}
+
+	def on_post_save(self, view):
+		window = view.window()
+		if not window or not utils.get_config('buildOnSave'):
+			return
+
+		from .toggle_ticked import is_tickable
+		fname = view.file_name()
+		if not is_tickable(fname) and not (fname and fname.endswith('.dme')):
+			return
+
+		window.run_command('dreammaker_build', {'kill': True, 'background': True})
+
+		key = window.id()
+		generation = self.generation.get(key, 0) + 1
+		self.generation[key] = generation
+
+		def build():
+			if self.generation.get(key) == generation:
+				window.run_command('dreammaker_build', {'background': True})
+		sublime.set_timeout(build, self.DEBOUNCE)
+
+
+class DreammakerBuildResultsCommand(sublime_plugin.WindowCommand):
+	def is_enabled(self, severity=None):
+		return self.window.id() in BuildResults.by_window
+
+	def run(self, severity=None):
+		results = BuildResults.by_window.get(self.window.id())
+		if not results:
+			return
+		self.diagnostics = [
+			each for each in results.snapshot()
+			if severity is None or each.severity == severity
+		]
+		if not self.diagnostics:
+			sublime.status_message("No build results")
+			return
+		self.window.show_quick_panel([
+			["{}: {}".format(each.severity, each.message), "{}:{}".format(each.file, each.line)]
+			for each in self.diagnostics
+		], self.on_select)
+
+	def on_select(self, index):
+		if index < 0:
+			return
+		each = self.diagnostics[index]
+		self.window.open_file("{}:{}".format(each.path, each.line), sublime.ENCODED_POSITION)
+
+
+class BuildResultsEventListener(sublime_plugin.EventListener):
+	def on_load(self, view):
+		window = view.window()
+		results = window and BuildResults.by_window.get(window.id())
+		if results:
+			results.mark(view)
+
+
+Diagnostic = namedtuple('Diagnostic', ['path', 'file', 'line', 'severity', 'message'])
+
+
+# Diagnostics parsed from the compiler output as it streams in, indexed by
+# the file they refer to. Open views get gutter markers for their file. One
+# instance collects the results of every .dme in a build.
+class BuildResults:
+	by_window = {}
+
+	REGION_KEY = "dreammaker_build_{}"
+	ICONS = {"error": "circle", "warning": "dot"}
+	SCOPES = {"error": "markup.deleted", "warning": "markup.changed"}
+
+	def __init__(self, window):
+		self.window = window
+		self.lock = threading.Lock()
+		self.diagnostics = []
+		self.by_file = {}
+		self.dirty = set()
+
+	def key(self, path):
+		return os.path.normcase(os.path.normpath(path))
+
+	def stream(self, base_dir, timings=None):
+		return ResultStream(self, base_dir, timings)
+
+	def add(self, each):
+		with self.lock:
+			self.diagnostics.append(each)
+			self.by_file.setdefault(self.key(each.path), []).append(each)
+			self.dirty.add(each.path)
+
+	def snapshot(self):
+		with self.lock:
+			return list(self.diagnostics)
+
+	def update_markers(self):
+		with self.lock:
+			dirty, self.dirty = self.dirty, set()
+		for path in dirty:
+			view = self.window.find_open_file(path)
+			if view:
+				self.mark(view)
+
+	def mark(self, view):
+		fname = view.file_name()
+		if not fname:
+			return
+		with self.lock:
+			diagnostics = list(self.by_file.get(self.key(fname), ()))
+
+		by_severity = {}
+		for each in diagnostics:
+			point = view.text_point(each.line - 1, 0)
+			by_severity.setdefault(each.severity, []).append(view.line(point))
+		for severity, regions in by_severity.items():
+			view.add_regions(
+				self.REGION_KEY.format(severity),
+				regions,
+				self.SCOPES.get(severity, "markup.changed"),
+				self.ICONS.get(severity, "dot"),
+				sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE)
+
+	def clear_markers(self):
+		with self.lock:
+			severities = set(each.severity for each in self.diagnostics)
+			paths = set(each.path for each in self.diagnostics)
+		for path in paths:
+			view = self.window.find_open_file(path)
+			if view:
+				for severity in severities:
+					view.erase_regions(self.REGION_KEY.format(severity))
+
+
+# Manifest of the content hashes of the .dme, everything it includes and the
+# resources the code refers to, as of the last successful build with a given
+# compiler. A build whose manifest matches, with the .dmb untouched since, is
+# answered with the output of that build instead of running the compiler.
+# Hashes, and the references found in code files, are only recomputed for
+# files whose mtime or size changed.
+class BuildCache:
+	VERSION = 2
+	CODE_EXTENSIONS = ('.dme', '.dm')
+	INCLUDE_RE = re.compile(r'^\s*#\s*include\s+"([^"]+)"', re.M)
+	FILE_DIR_RE = re.compile(r'^\s*#\s*define\s+FILE_DIR\s+(.+?)\s*$', re.M)
+	# Single-quoted file literals, such as 'icons/mob.dmi'. Matches in
+	# comments are harmless: they are hashed if they exist and skipped if not.
+	RESOURCE_RE = re.compile(r"'([^'\\\n]+\.\w+)'")
+
+	def __init__(self, dme_path, exe):
+		self.dme_path = dme_path
+		self.dmb_path = os.path.splitext(dme_path)[0] + '.dmb'
+		self.base = os.path.dirname(os.path.abspath(dme_path))
+		self.compiler = [exe] + (file_stamp(exe) or [])
+		name = hashlib.md5(os.path.abspath(dme_path).encode('utf-8')).hexdigest()
+		self.path = os.path.join(utils.cache_path(), 'builds', name + '.json')
+		self.files = None
+		self.output = None
+		try:
+			with open(self.path, encoding='utf-8') as f:
+				self.previous = json.load(f)
+		except (OSError, ValueError):
+			self.previous = {}
+		if self.previous.get('version') != self.VERSION:
+			self.previous = {}
+
+	def compute(self):
+		from .toggle_ticked import EnvironmentFile
+
+		# Includes are ASCII in practice, so don't fail on whatever encoding
+		# the rest of the file uses.
+		with open(self.dme_path, encoding='latin1') as f:
+			env = EnvironmentFile.from_stream(f)
+		if EnvironmentFile.BEGIN not in env.header or EnvironmentFile.END not in env.footer:
+			raise Uncacheable("no BEGIN_INCLUDE/END_INCLUDE markers")
+		if any(self.INCLUDE_RE.match(line) for line in env.header + env.footer):
+			raise Uncacheable("#include outside the BEGIN_INCLUDE/END_INCLUDE markers")
+
+		known = self.previous.get('files', {})
+		self.files = {}
+
+		# Follow #includes from every code file, each relative to the file it
+		# appears in.
+		pending = [os.path.basename(self.dme_path)]
+		while pending:
+			key = pending.pop()
+			if key in self.files:
+				continue
+			entry = self.files[key] = self.hash(key, known.get(key), scan=True)
+			if entry and len(entry) > 3:
+				pending.extend(entry[3]['include'])
+
+		# Resources are looked up in the .dme's directory, then each FILE_DIR.
+		# Every candidate up to the one found is recorded, so a file appearing
+		# earlier in the search path also counts as a change.
+		dirs = ['']
+		code = [entry for entry in self.files.values() if entry and len(entry) > 3]
+		for entry in code:
+			dirs.extend(d for d in entry[3]['file_dir'] if d not in dirs)
+		for entry in code:
+			for resource in entry[3]['resource']:
+				candidates = [self.key(os.path.join(d, resource)) for d in dirs]
+				if not any(os.path.isfile(os.path.join(self.base, c)) for c in candidates):
+					continue
+				for candidate in candidates:
+					if candidate not in self.files:
+						self.files[candidate] = self.hash(candidate, known.get(candidate))
+					if self.files[candidate]:
+						break
+
+	def key(self, path):
+		return os.path.normpath(path.replace('\\', os.sep))
+
+	def hash(self, key, before, scan=False):
+		path = os.path.join(self.base, key)
+		stamp = file_stamp(path)
+		if stamp is None or not os.path.isfile(path):
+			return None
+		scan = scan and key.lower().endswith(self.CODE_EXTENSIONS)
+		if before and before[:2] == stamp and len(before) == (4 if scan else 3):
+			return before
+		if not scan:
+			return stamp + [utils.md5_file(path)]
+
+		with open(path, 'rb') as f:
+			data = f.read()
+		text = data.decode('latin1')
+		here = os.path.dirname(key)
+		refs = {
+			'include': [self.key(os.path.join(here, each)) for each in self.INCLUDE_RE.findall(text)],
+			'file_dir': [self.key(each.strip('"')) for each in self.FILE_DIR_RE.findall(text)],
+			'resource': sorted(set(self.RESOURCE_RE.findall(text))),
+		}
+		return stamp + [hashlib.md5(data).hexdigest(), refs]
+
+	def up_to_date(self):
+		known = self.previous.get('files')
+		if not known or self.previous.get('dmb') != file_stamp(self.dmb_path):
+			return False
+		if self.previous.get('compiler') != self.compiler:
+			return False
+		if known.keys() != self.files.keys():
+			return False
+		for key, entry in self.files.items():
+			before = known[key]
+			if (entry is None) != (before is None):
+				return False
+			if entry is not None and entry[2] != before[2]:
+				return False
+		self.output = self.previous.get('output', '')
+		return True
+
+	def save(self, output):
+		data = {
+			'version': self.VERSION,
+			'compiler': self.compiler,
+			'files': self.files,
+			'dmb': file_stamp(self.dmb_path),
+			'output': output,
+		}
+		os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		with open(self.path, 'w', encoding='utf-8') as f:
+			json.dump(data, f)
+
+
+class Uncacheable(Exception):
+	pass
+
+
+def file_stamp(path):
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	return [st.st_mtime, st.st_size]
+
+
+# Splits one build's output into lines, which may arrive in arbitrary
+# pieces, and parses them into its BuildResults. Paths are relative to the
+# directory of the .dme being compiled.
+class ResultStream:
+	LINE_RE = re.compile(r"^([^:]+):(\d+):([^:]+): (.*)$")
+
+	def __init__(self, results, base_dir, timings=None):
+		self.results = results
+		self.base_dir = base_dir
+		self.timings = timings
+		self.partial = ""
+
+	def feed(self, text, final=False):
+		lines = (self.partial + text).split("\n")
+		self.partial = "" if final else lines.pop()
+		for line in lines:
+			match = self.LINE_RE.match(line.rstrip("\r"))
+			if not match:
+				if self.timings:
+					self.timings.line(line)
+				continue
+			file, line, severity, message = match.groups()
+			path = os.path.join(self.base_dir, file.replace("\\", os.sep))
+			self.results.add(Diagnostic(path, file, int(line), severity, message))
+
+
+# Wall-clock time, CPU time and peak memory of one compile, plus when each
+# phase first showed up in DreamMaker's progress output. Finished builds are
+# appended to a JSON-lines history in the cache directory.
+class BuildTimings:
+	PHASE_RE = re.compile(r"^(loading|including|saving) ")
+	VERSION_RE = re.compile(r"^DM compiler version (\S+)")
+	HISTORY = "build_history.jsonl"
+	history_lock = threading.Lock()
+
+	def __init__(self, dme_path):
+		self.dme_path = dme_path
+		self.started = time.time()
+		self.wall = None
+		self.cpu_user = None
+		self.cpu_system = None
+		self.max_rss = None  # KiB
+		self.phases = {}
+		self.version = None
+
+	def line(self, line):
+		match = self.VERSION_RE.match(line)
+		if match:
+			self.version = match.group(1)
+			return
+		match = self.PHASE_RE.match(line)
+		if match and match.group(1) not in self.phases:
+			self.phases[match.group(1)] = round(time.time() - self.started, 3)
+
+	def wait(self, proc):
+		if not hasattr(os, 'wait4'):
+			returncode = proc.wait()
+			self.wall = time.time() - self.started
+			return returncode
+
+		# Reap the child ourselves to get its resource usage.
+		try:
+			_, status, usage = os.wait4(proc.pid, 0)
+		except ChildProcessError:
+			# Already reaped by a concurrent poll().
+			returncode = proc.wait()
+			self.wall = time.time() - self.started
+			return returncode
+		self.wall = time.time() - self.started
+		if os.WIFSIGNALED(status):
+			proc.returncode = -os.WTERMSIG(status)
+		else:
+			proc.returncode = os.WEXITSTATUS(status)
+		self.cpu_user = usage.ru_utime
+		self.cpu_system = usage.ru_stime
+		self.max_rss = usage.ru_maxrss
+		if sublime.platform() == 'osx':
+			self.max_rss //= 1024  # reported in bytes rather than KiB
+		return proc.returncode
+
+	def describe(self):
+		bits = ["in {:.1f}s".format(self.wall)]
+		if self.cpu_user is not None:
+			bits.append("CPU {:.1f}s".format(self.cpu_user + self.cpu_system))
+			bits.append("peak {} MiB".format(self.max_rss // 1024))
+		return "({})".format(", ".join(bits))
+
+	def record(self, success):
+		entry = {
+			'time': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)),
+			'dme': self.dme_path,
+			'success': success,
+			'wall': round(self.wall, 3),
+			'cpu_user': self.cpu_user,
+			'cpu_system': self.cpu_system,
+			'max_rss_kib': self.max_rss,
+			'phases': self.phases,
+			'byond': self.version,
+		}
+		path = os.path.join(utils.cache_path(), self.HISTORY)
+		try:
+			with self.history_lock:
+				os.makedirs(os.path.dirname(path), exist_ok=True)
+				with open(path, 'a', encoding='utf-8') as f:
+					f.write(json.dumps(entry) + '\n')
+		except OSError as e:
+			print("dreammaker build: failed to record timings:", e)
+
+	@classmethod
+	def history(cls):
+		path = os.path.join(utils.cache_path(), cls.HISTORY)
+		entries = []
+		try:
+			with open(path, encoding='utf-8') as f:
+				for line in f:
+					try:
+						entries.append(json.loads(line))
+					except ValueError:
+						pass
+		except OSError:
+			pass
+		return entries
+
+
+class DreammakerBuildHistoryCommand(sublime_plugin.WindowCommand):
+	LIMIT = 30
+
+	def run(self):
+		entries = BuildTimings.history()[-self.LIMIT:]
+		lines = ["{:<20} {:<24} {:>8} {:>8} {:>9}  {}".format(
+			"time", "environment", "wall", "cpu", "peak MiB", "phases (s)")]
+		previous = {}
+		for each in entries:
+			name = os.path.basename(each['dme'])
+			cpu = each['cpu_user'] + each['cpu_system'] if each.get('cpu_user') is not None else None
+			rss = each['max_rss_kib'] // 1024 if each.get('max_rss_kib') is not None else None
+			trend = ""
+			if name in previous and previous[name]:
+				change = (each['wall'] - previous[name]) / previous[name] * 100
+				trend = " {:+.0f}%".format(change)
+			if each['success']:
+				previous[name] = each['wall']
+			lines.append("{:<20} {:<24} {:>8} {:>8} {:>9}  {}{}".format(
+				each['time'],
+				name if each['success'] else name + " (failed)",
+				"{:.1f}s".format(each['wall']),
+				"{:.1f}s".format(cpu) if cpu is not None else "-",
+				rss if rss is not None else "-",
+				" ".join("{}={}".format(k, v) for k, v in sorted(each['phases'].items(), key=lambda kv: kv[1])),
+				trend))
+
+		panel = self.window.create_output_panel("DreamMaker Build History")
+		panel.run_command('append', {'characters': "\n".join(lines)})
+		self.window.run_command('show_panel', {'panel': 'output.DreamMaker Build History'})
+
+
+# Yields (text, final) pairs read from `fd` until EOF. The decoder holds on to
+# any trailing partial multibyte character until the rest of it is read, and
+# replaces invalid sequences rather than failing, so the pipe is always drained.
+def read_output(fd, encoding, chunk_size=2 ** 16):
+	decoder = make_decoder(encoding)
+	while True:
+		try:
+			data = os.read(fd, chunk_size)
+		except IOError:
+			data = b""
+		yield decoder.decode(data, final=not data), not data
+		if not data:
+			return
+
+
+def make_decoder(encoding):
+	try:
+		return codecs.getincrementaldecoder(encoding)(errors='replace')
+	except LookupError:
+		print('dreammaker build: unknown encoding {!r}, using utf-8'.format(encoding))
+		return codecs.getincrementaldecoder('utf-8')(errors='replace')
@@ -16,18 +16,17 @@
 
 # language_client.py - LSP provider with DMLS updates and extensions.
 
+from .utils import perf
+_imported = perf.import_timer(__name__)
+
 import os
-import stat
-import gzip
-import shutil
-import urllib
 import sublime, sublime_plugin
 
-from threading import Thread
+from threading import Event, Thread
 from LSP.plugin.core.handlers import LanguageHandler
 from LSP.plugin.core.settings import ClientConfig, LanguageConfig
 
-from time import sleep
+from time import sleep, monotonic
 
 from . import utils
 from .utils import *
@@ -63,14 +62,37 @@ default_config = ClientConfig(
 update_available = False
 status_text = 'DM: Starting...'
 
+# The server command, once prepare_server_thread has determined it.
+server_ready = utils.Ready()
+startup = {}
+
 
 def plugin_loaded():
+	startup_mark('loaded')
 	sublime.active_window().status_message(status_text)
 	Thread(target=prepare_server_thread).start()
 
 
 def prepare_server_thread():
-	default_config.binary_args[0] = determine_server_command()
+	command = determine_server_command()
+	default_config.binary_args[0] = command
+	startup_mark('command ready')
+	print('dm-langserver startup:', startup_report())
+	server_ready.set(command)
+
+
+# Seconds since plugin_loaded at which each startup step finished.
+def startup_mark(step):
+	if step == 'loaded':
+		startup.clear()
+		startup['loaded'] = monotonic()
+	elif 'loaded' in startup:
+		startup[step] = monotonic() - startup['loaded']
+
+
+def startup_report():
+	steps = sorted((t, step) for step, t in startup.items() if step != 'loaded')
+	return ", ".join("{} at {:.3f}s".format(step, t) for t, step in steps)
 
 
 ###############################################################################
@@ -85,6 +107,7 @@ class Instance:
 class LspDreammakerPlugin(LanguageHandler):
 	last_instance = None
 	instances = {}
+	waiting = set()
 
 	def __init__(self):
 		self._name = default_name
@@ -101,10 +124,15 @@ class LspDreammakerPlugin(LanguageHandler):
 		return self._config
 
 	def on_start(self, window) -> bool:
-		# Still waiting on prepare_server_thread to finish.
-		if not default_config.binary_args[0]:
-			# When we return False, it seems that LSP will call us again later,
-			# so we have an opportunity to continue configuring.
+		# Still waiting on prepare_server_thread to finish. Once the command
+		# is known, ask LSP to start again rather than waiting for the user
+		# to activate a view.
+		if not server_ready.is_set():
+			if window.id() not in LspDreammakerPlugin.waiting:
+				LspDreammakerPlugin.waiting.add(window.id())
+				server_ready.subscribe(lambda command: retry_start(window, command))
+			return False
+		if not server_ready.value:
 			return False
 
 		# This is brittle, but it appears to be the only way.
@@ -115,6 +143,9 @@ class LspDreammakerPlugin(LanguageHandler):
 
 	def on_initialized(self, client) -> None:
 		LspDreammakerPlugin.last_instance.client = client
+		if 'initialized' not in startup:
+			startup_mark('initialized')
+			print('dm-langserver startup:', startup_report())
 
 		# Add handlers for the extension methods.
 		client.on_notification('$window/status', self.on_window_status)
@@ -126,6 +157,7 @@ class LspDreammakerPlugin(LanguageHandler):
 		else:
 			object_tree.on_initialized(client)
 
+	@perf.timed('on_window_status')
 	def on_window_status(self, message):
 		global status_text
 		if message['environment']:
@@ -166,6 +198,19 @@ class LspDreammakerPlugin(LanguageHandler):
 		sublime.active_window().status_message(status_text)
 
 
+def retry_start(window, command):
+	LspDreammakerPlugin.waiting.discard(window.id())
+	if not command:
+		return
+	try:
+		from LSP.plugin.core.registry import windows
+		start_active_views = windows.lookup(window).start_active_views
+	except (ImportError, AttributeError) as e:
+		print("dm-langserver: can't start with this LSP version, activate a view to start:", e)
+		return
+	start_active_views()
+
+
 ###############################################################################
 # Server command lookup and autoupdater
 
@@ -177,6 +222,7 @@ def determine_server_command():
 		# ".update" files are still supported here to allow easy updating of
 		# local builds.
 		update_copy(server_command, "{}.update".format(server_command))
+		startup_mark('update copied')
 		if is_executable(server_command):
 			return server_command
 		else:
@@ -189,38 +235,56 @@ def determine_server_command():
 	auto_file = "{}/bin/dm-langserver-{}-{}{}".format(cache_path(), arch, platform, extension)
 	update_file = "{}.update".format(auto_file)
 	update_copy(auto_file, update_file)
+	startup_mark('update copied')
 
 	if is_executable(auto_file):
 		# If the executable is already valid, run it now, and update later.
-		Thread(target=lambda: auto_update(platform, arch, update_file, md5_file(auto_file))).start()
+		def check_for_update():
+			auto_update(platform, arch, update_file, md5_file(auto_file), auto_file)
+			startup_mark('update checked')
+		Thread(target=check_for_update).start()
 	else:
 		# Otherwise, update now.
 		os.makedirs("{}/bin".format(cache_path()), exist_ok=True)
 		failure = auto_update(platform, arch, auto_file, None)
 		if failure:
 			return prompt_for_server_command(failure)
+		startup_mark('downloaded')
 
-		# Debounce to handle the file being busy if accessed by antivirus or
-		# similar immediately after download.
-		sleep(0.5)
+		# Antivirus or similar may hold the file for a moment after download.
+		wait_until_openable(auto_file)
 
 	return auto_file
 
 
 def update_copy(main_file, update_file):
-	for _ in range(8):
+	delay = 0.02
+	for _ in range(6):
 		if not os.path.exists(update_file):
 			return
 		try:
 			os.replace(update_file, main_file)
 			return
-		except:
+		except OSError:
 			pass
 		# If this fails, it might be because the old process is still
 		# running in this window. Wait a bit and try again.
-		sleep(0.25)
-	# Last chance, and if it really fails, propagate that up
-	os.replace(update_file, main_file)
+		sleep(delay)
+		delay *= 2
+	# Still busy: keep using the old binary and try again next time.
+	print('dm-langserver: could not replace {} with its update'.format(main_file))
+
+
+def wait_until_openable(path, timeout=2):
+	deadline = monotonic() + timeout
+	while True:
+		try:
+			with open(path, 'rb'):
+				return
+		except OSError:
+			if monotonic() > deadline:
+				return
+		sleep(0.02)
 
 
 def lock_and_notify(cv):
@@ -231,23 +295,29 @@ def lock_and_notify(cv):
 def prompt_for_server_command(message):
 	message = "The dm-langserver executable must be specified.\n\n{}".format(message)
 
-	opened = False
-	current = utils.get_config('langserverPath')
-	while not current or not is_executable(current):
-		if not sublime.ok_cancel_dialog(message, "Edit"):
-			return
+	changed = Event()
+	utils.settings.subscribe('langserverPath', changed.set)
+	try:
+		opened = False
+		current = utils.get_config('langserverPath')
+		while not current or not is_executable(current):
+			if not sublime.ok_cancel_dialog(message, "Edit"):
+				return
 
-		if not opened:
-			utils.open_config()
-			opened = True
+			if not opened:
+				utils.open_config()
+				opened = True
 
-		while utils.get_config('langserverPath') == current:
-			sleep(1)
+			while utils.get_config('langserverPath') == current:
+				changed.wait()
+				changed.clear()
 
-		current = utils.get_config('langserverPath')
-		message = "The specified path is not a valid executable."
+			current = utils.get_config('langserverPath')
+			message = "The specified path is not a valid executable."
 
-	return current
+		return current
+	finally:
+		utils.settings.unsubscribe('langserverPath', changed.set)
 
 
 def config_auto_update(hash):
@@ -293,16 +363,25 @@ def config_auto_update(hash):
 		return False
 
 
-def auto_update(platform, arch, out_file, hash):
+UPDATE_URL = "https://wombat.platymuus.com/ss13/dm-langserver/update.php"
+PATCH_FORMAT = 'bsdiff40'
+
+
+# If `base_file` is given, the server may answer with a patch from it (which
+# must have the given `hash`) to the new version, rather than the whole thing.
+def auto_update(platform, arch, out_file, hash, base_file=None):
 	global status_text, update_available
 
 	if not config_auto_update(hash):
 		return "Auto-update disabled."
 
-	url = "https://wombat.platymuus.com/ss13/dm-langserver/update.php?sublime={}&platform={}&arch={}".format(__version__, platform, arch)
+	url = "{}?sublime={}&platform={}&arch={}".format(UPDATE_URL, __version__, platform, arch)
 	if hash:
 		url += "&hash={}".format(hash)
+		if base_file:
+			url += "&patch={}".format(PATCH_FORMAT)
 
+	import urllib.request
 	try:
 		res = urllib.request.urlopen(url)
 	except Exception as e:
@@ -310,21 +389,32 @@ def auto_update(platform, arch, out_file, hash):
 
 	print('dm-langserver updater:', res.status, res.reason)
 	if res.status == 200:  # New version
-		with open(out_file, "wb") as stream:
-			encoding = res.headers.get('Content-encoding')
-			if encoding == 'gzip':
-				with gzip.open(res) as gz:
-					stream.write(gz.read())
-			elif encoding is None:
-				with res:
-					stream.write(res.read())
-			else:
-				return "Unknown Content-encoding: {}".format(encoding)
-
-		# mark the file as executable
-		mode = os.stat(out_file).st_mode
-		mode |= stat.S_IXUSR
-		os.chmod(out_file, mode)
+		from .utils.download import download
+
+		# Either header is only sent when the server knows the answer.
+		patch_format = res.headers.get('X-Patch-Format')
+		target_hash = res.headers.get('X-Target-Hash')
+
+		if patch_format:
+			# Patches are only asked for with a base file. Falling back asks
+			# without one, so a patch in reply to that is an error.
+			if not base_file:
+				return "Server sent a patch when the full file was requested."
+			failure = apply_update_patch(res, patch_format, base_file, out_file, target_hash)
+			if failure:
+				print('dm-langserver updater: patch failed, downloading in full:', failure)
+				return auto_update(platform, arch, out_file, hash)
+		else:
+			try:
+				digest = download(res, out_file, download_progress, executable=True)
+			except ValueError as e:
+				return "{}".format(e)
+			except Exception as e:
+				return "Download failed: {}.".format(e)
+			print('dm-langserver updater: downloaded', digest)
+			if target_hash and digest != target_hash:
+				os.remove(out_file)
+				return "Downloaded file is corrupt."
 
 		if hash:
 			if not update_available:
@@ -347,3 +437,40 @@ def auto_update(platform, arch, out_file, hash):
 
 	else:  # Error
 		return "Server returned {} {}.".format(res.status, res.reason)
+
+
+def apply_update_patch(res, patch_format, base_file, out_file, target_hash):
+	from .utils.download import download
+	from .utils.bspatch import apply_patch
+
+	if patch_format != PATCH_FORMAT or not target_hash:
+		return "unsupported patch {!r}".format(patch_format)
+
+	patch_file = "{}.patch".format(out_file)
+	try:
+		download(res, patch_file, download_progress)
+		digest = apply_patch(base_file, patch_file, out_file)
+	except Exception as e:
+		return "{}".format(e)
+	finally:
+		try:
+			patch_size = os.path.getsize(patch_file)
+			os.remove(patch_file)
+		except OSError:
+			patch_size = None
+
+	if digest != target_hash:
+		os.remove(out_file)
+		return "patched file has hash {}, not {}".format(digest, target_hash)
+	print('dm-langserver updater: patched to', digest, 'from a patch of', patch_size, 'bytes')
+
+
+def download_progress(done, total):
+	if total:
+		text = "DM: downloading dm-langserver... {}%".format(done * 100 // total)
+	else:
+		text = "DM: downloading dm-langserver... {} KiB".format(done // 1024)
+	sublime.active_window().status_message(text)
+
+
+_imported()
@@ -16,9 +16,17 @@
 
 # HTML view for the DreamMaker object tree.
 
-import sublime, sublime_plugin
+from .utils import perf
+_imported = perf.import_timer(__name__)
+
+import bisect
+import functools
+import threading
+import traceback
+
+from sys import intern
 
-from LSP.plugin.core import sessions
+import sublime, sublime_plugin
 
 from . import utils
 
@@ -30,11 +38,16 @@ except ImportError:
 
 has_been_initialized = False
 objtree_root = None
-expanded = set()
-
+types = {}  # type path -> type entry
+type_index = None
+expanded = set()  # type paths
 
-def plugin_loaded():
-	ObjtreeView.instance = ObjtreeView()
+STYLE = """<style>
+	a {text-decoration: none;}
+	.expand, .contract {color: lightblue;}
+	.go {color: white;}
+	.nolink {color: red;}
+	</style>"""
 
 
 def on_initialized(client):
@@ -43,35 +56,380 @@ def on_initialized(client):
 	client.on_notification('experimental/dreammaker/objectTree', on_object_tree)
 
 
+@perf.timed('on_object_tree')
 def on_object_tree(message):
-	global objtree_root
-	objtree_root = message["root"]
-	ObjtreeView.instance.update()
+	builder.submit(message)
+
+
+# Converts, diffs and renders incoming trees on a worker thread. Only the
+# newest tree is built; one which is superseded mid-build is abandoned, and
+# only the phantom updates are done on the main thread.
+class TreeBuilder:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.message = None
+		self.generation = 0
+		self.running = False
+
+	def submit(self, message):
+		with self.lock:
+			self.message = message
+			self.generation += 1
+			if self.running:
+				return
+			self.running = True
+		threading.Thread(target=self.run).start()
+
+	def run(self):
+		finished = False
+		try:
+			while True:
+				with self.lock:
+					message, generation = self.message, self.generation
+					self.message = None
+					if message is None:
+						self.running = False
+						finished = True
+						return
+				try:
+					update = self.build(message, generation)
+				except Exception:
+					# Skip a tree which can't be built; the next one may be fine.
+					print("dreammaker: failed to build object tree:")
+					traceback.print_exc()
+					continue
+				if update is not None:
+					sublime.set_timeout(functools.partial(apply_tree, update), 0)
+		finally:
+			# Never leave the builder marked as busy with no thread running.
+			if not finished:
+				with self.lock:
+					self.running = False
+
+	@perf.timed('object_tree.build')
+	def build(self, message, generation):
+		update = TreeUpdate(generation, types)
+		update.root = TypeNode.convert(message["root"], "", update.types)
+		if generation != self.generation:
+			return
+		update.changed = diff_types(update.base, update.types)
+		if generation != self.generation:
+			return
+
+		update.index = TypeIndex(update.types, utils.get_config('objectTreeSearchMembers'))
+		if generation != self.generation:
+			return
+
+		# Render the rows which will need it ahead of time.
+		snapshot = set(expanded)
+		for path in visible_descendants("", update.types, snapshot):
+			if path in update.changed or path not in update.base:
+				is_expanded = path in snapshot
+				update.fragments[path, is_expanded] = get_type_content(update.types[path], is_expanded)
+		return update
+
+
+class TreeUpdate:
+	def __init__(self, generation, base):
+		self.generation = generation
+		self.base = base  # the tree this one was diffed against
+		self.root = None
+		self.types = {}
+		self.changed = set()
+		self.fragments = {}
+		self.index = None
+
+
+builder = TreeBuilder()
+
+
+@perf.timed('object_tree.apply')
+def apply_tree(update):
+	global objtree_root, types, type_index
+	if update.generation != builder.generation:
+		return
+
+	changed = update.changed
+	if update.base is not types:
+		changed = diff_types(types, update.types)
+
+	first = objtree_root is None
+	objtree_root = update.root
+	types = update.types
+	type_index = update.index
+	expanded.intersection_update(types)
+	for path in changed:
+		fragments.evict(path)
+	fragments.cache.update(update.fragments)
+
+	if first:
+		ObjtreeView.get().update()
+	else:
+		ObjtreeView.get().patch(changed)
+
+
+# Paths whose rows must be re-rendered: those which were removed, or whose
+# name, location, or having children differ from the previous tree.
+def diff_types(old, new):
+	changed = set(old.keys() - new.keys())
+	for path, ty in new.items():
+		before = old.get(path)
+		if before is not None and (
+			ty.name != before.name
+			or ty.location != before.location
+			or bool(ty.children) != bool(before.children)
+		):
+			changed.add(path)
+	return changed
+
+
+# Compact form of an ObjectTreeType. Only the names of vars and procs are
+# kept, and the location is flattened to a (uri, line, character) tuple.
+# Strings which repeat across the tree are interned.
+class TypeNode:
+	__slots__ = ('path', 'name', 'location', 'vars', 'procs', 'children')
+
+	def __init__(self, path, name, location, vars, procs, children):
+		self.path = path
+		self.name = name
+		self.location = location
+		self.vars = vars
+		self.procs = procs
+		self.children = children
+
+	@staticmethod
+	def convert(entry, path, out):
+		children = tuple(
+			TypeNode.convert(child, child_path(path, child["name"]), out)
+			for child in entry["children"]
+		)
+		node = TypeNode(
+			path,
+			intern(entry["name"]),
+			compact_location(entry.get("location")),
+			intern_names(entry["vars"]),
+			intern_names(entry["procs"]),
+			children,
+		)
+		out[path] = node
+		return node
+
+
+def intern_names(entries):
+	if not entries:
+		return ()
+	return tuple(sorted(set(intern(each["name"]) for each in entries)))
+
+
+def compact_location(location):
+	if not location:
+		return None
+	start = location["range"]["start"]
+	return intern(location["uri"]), start["line"], start["character"]
+
+
+def child_path(parent, name):
+	if name.startswith("/"):
+		return name
+	return "{}/{}".format(parent, name)
 
 
 class DreammakerObjectTreeCommand(sublime_plugin.WindowCommand):
 	def run(self):
-		ObjtreeView.instance.open_view(self.window)
+		ObjtreeView.get().open_view(self.window)
+
+
+class DreammakerObjectTreeSearchCommand(sublime_plugin.WindowCommand):
+	def is_enabled(self):
+		return type_index is not None
+
+	def run(self):
+		self.window.show_input_panel("Find type:", "", self.on_done, None, None)
+
+	def on_done(self, query):
+		matches = type_index.search(query)
+		if not matches:
+			sublime.status_message("No types match {}".format(query))
+		elif len(matches) == 1:
+			self.reveal(matches[0])
+		else:
+			self.matches = matches
+			self.window.show_quick_panel([entry for entry, _ in matches], self.on_select)
+
+	def on_select(self, index):
+		if index >= 0:
+			self.reveal(self.matches[index])
+
+	def reveal(self, match):
+		entry, path = match
+		ObjtreeView.get().reveal(self.window, path)
+
+
+class DmInternalObjtreeEditCommand(sublime_plugin.TextCommand):
+	def run(self, edit, begin, erase, insert):
+		self.view.set_read_only(False)
+		self.view.erase(edit, sublime.Region(begin, begin + erase))
+		self.view.insert(edit, begin, insert)
+		self.view.set_read_only(True)
 
 
 class ObjtreeEventListener(sublime_plugin.EventListener):
+	def on_activated(self, view):
+		ObjtreeView.claim(view)
+
 	def on_close(self, view):
-		ObjtreeView.instance.on_close(view)
+		ObjtreeView.release(view)
 
 
+# Each visible type gets its own line in the view, holding one inline phantom
+# at the end of the line. Expanding or contracting a type only inserts or
+# erases the lines of its visible descendants; the rest of the tree's phantoms
+# move along with the text and are not re-rendered.
 class ObjtreeView(utils.HtmlView):
-	instance = None
 	phantom_set_key = "dreammaker_object_tree"
 	name = "DM Object Tree"
 
+	ROW = " \n"
+
+	def __init__(self):
+		self.rows = []  # visible type paths, one per line
+		self.phantom_ids = []
+		super().__init__()
+
+	def update(self):
+		if not self.view:
+			return
+
+		self.view.erase_phantoms(self.phantom_set_key)
+		self.rows = []
+		self.phantom_ids = []
+
+		if objtree_root is None:
+			if has_been_initialized:
+				message = "Loading..."
+			else:
+				message = "Open a .dm file to load the object tree."
+			self.edit(0, self.view.size(), self.ROW)
+			self.view.add_phantom(self.phantom_set_key, sublime.Region(1, 1), message, sublime.LAYOUT_INLINE)
+			return
+
+		rows = visible_descendants("")
+		self.edit(0, self.view.size(), self.ROW * len(rows))
+		self.insert_phantoms(0, rows)
+		fragments.report()
+
+	# Bring the view up to date with a new tree by replacing the rows between
+	# the unchanged prefix and suffix, plus any changed rows outside them.
+	def patch(self, changed):
+		if not self.view:
+			return
+
+		rows = visible_descendants("")
+		old_rows = self.rows
+		limit = min(len(rows), len(old_rows))
+		prefix = 0
+		while prefix < limit and rows[prefix] == old_rows[prefix]:
+			prefix += 1
+		suffix = 0
+		while suffix < limit - prefix and rows[-1 - suffix] == old_rows[-1 - suffix]:
+			suffix += 1
+
+		removed = len(old_rows) - prefix - suffix
+		added = rows[prefix:len(rows) - suffix]
+		if removed or added:
+			self.remove_phantoms(prefix, removed)
+			self.edit(prefix * len(self.ROW), removed * len(self.ROW), self.ROW * len(added))
+			self.insert_phantoms(prefix, added)
+
+		if changed:
+			for index, path in enumerate(self.rows):
+				if path in changed and not prefix <= index < prefix + len(added):
+					self.remove_phantoms(index, 1)
+					self.insert_phantoms(index, [path])
+
+		fragments.report()
+
+	def on_close(self, view):
+		super().on_close(view)
+		if not self.view:
+			self.rows = []
+			self.phantom_ids = []
+
+	def edit(self, begin, erase, insert):
+		self.view.run_command("dm_internal_objtree_edit", {"begin": begin, "erase": erase, "insert": insert})
+
+	def insert_phantoms(self, index, rows):
+		ids = []
+		for i, path in enumerate(rows, index):
+			point = i * len(self.ROW) + 1
+			ids.append(self.view.add_phantom(
+				self.phantom_set_key,
+				sublime.Region(point, point),
+				fragments.get(path),
+				sublime.LAYOUT_INLINE,
+				self._on_navigate))
+		self.rows[index:index] = rows
+		self.phantom_ids[index:index] = ids
+
+	def remove_phantoms(self, index, count):
+		for phantom_id in self.phantom_ids[index:index + count]:
+			self.view.erase_phantom_by_id(phantom_id)
+		del self.rows[index:index + count]
+		del self.phantom_ids[index:index + count]
+
+	def toggle(self, path, expand):
+		if expand == (path in expanded):
+			return
+
+		if expand:
+			expanded.add(path)
+			below = visible_descendants(path)
+		else:
+			below = visible_descendants(path)
+			expanded.remove(path)
+
+		if not self.view or path not in self.rows:
+			return
+
+		index = self.rows.index(path)
+		begin = (index + 1) * len(self.ROW)
+		if expand:
+			self.edit(begin, 0, self.ROW * len(below))
+			self.insert_phantoms(index + 1, below)
+		else:
+			self.remove_phantoms(index + 1, len(below))
+			self.edit(begin, len(below) * len(self.ROW), "")
+		self.remove_phantoms(index, 1)
+		self.insert_phantoms(index, [path])
+		fragments.report()
+
+	def reveal(self, window, path):
+		if path not in types:
+			return
+		if self.view:
+			window.focus_view(self.view)
+		else:
+			self.open_view(window)
+
+		ancestors = []
+		parent = path[:path.rfind("/")]
+		while parent:
+			ancestors.append(parent)
+			parent = parent[:parent.rfind("/")]
+		for each in reversed(ancestors):
+			self.toggle(each, True)
+
+		point = self.rows.index(path) * len(self.ROW)
+		self.view.sel().clear()
+		self.view.sel().add(sublime.Region(point, point))
+		self.view.show_at_center(point)
+
 	def on_navigate(self, href):
 		if href.startswith('expand:'):
-			expanded.add(href[len('expand:'):])
-			self.update()
+			self.toggle(href[len('expand:'):], True)
 
 		elif href.startswith('contract:'):
-			expanded.remove(href[len('contract:'):])
-			self.update()
+			self.toggle(href[len('contract:'):], False)
 
 		elif href.startswith('dmref:'):
 			self.view.window().run_command("dreammaker_open_reference", {"dm_path": href[len('dmref:'):]})
@@ -83,56 +441,126 @@ class ObjtreeView(utils.HtmlView):
 			# langserver, even when they are first modified.
 			self.view.window().open_file(fname, sublime.ENCODED_POSITION)
 
-	def get_content(self):
-		if objtree_root is None:
-			if has_been_initialized:
-				return "Loading..."
-			else:
-				return "Open a .dm file to load the object tree."
-
-		bits = ["""<style>
-			a {text-decoration: none;}
-			.expand, .contract {color: lightblue;}
-			.go {color: white;}
-			.nolink {color: red;}
-			</style>"""]
-		get_type_content(objtree_root, bits)
-		return "".join(bits)
-
-
-def get_type_content(ty, bits):
-	if ty["name"]:
-		if ty["children"]:
-			if ty["name"] in expanded:
-				bits.append("<a class='contract' href='contract:{}'>--</a> ".format(ty["name"], len(ty["children"])))
-			else:
-				bits.append("<a class='expand' href='expand:{}'>++</a> ".format(ty["name"], len(ty["children"])))
+
+# Search index over every type path, and optionally var and proc paths such as
+# /mob/proc/Login which lead to their type. Queries starting with "/" match by
+# prefix first, using bisection over the sorted entries; the rest of the
+# matches come from a substring search over all entries joined into one
+# lowercase string.
+class TypeIndex:
+	LIMIT = 500
+
+	def __init__(self, tree, members=False):
+		entries = []
+		for path, ty in tree.items():
+			if not path:
+				continue
+			entries.append((path, path))
+			if members:
+				entries.extend(("{}/var/{}".format(path, name), path) for name in ty.vars)
+				entries.extend(("{}/proc/{}".format(path, name), path) for name in ty.procs)
+		entries.sort()
+		self.entries = entries
+		self.keys = [entry for entry, _ in entries]
+		self.blob = "\n".join(self.keys).lower()
+		self.starts = []
+		offset = 0
+		for key in self.keys:
+			self.starts.append(offset)
+			offset += len(key) + 1
+
+	def search(self, query):
+		results = []
+		seen = set()
+		if query.startswith("/"):
+			i = bisect.bisect_left(self.keys, query)
+			while i < len(self.keys) and self.keys[i].startswith(query) and len(results) < self.LIMIT:
+				results.append(self.entries[i])
+				seen.add(i)
+				i += 1
+
+		needle = query.lower()
+		pos = self.blob.find(needle) if needle else -1
+		while pos >= 0 and len(results) < self.LIMIT:
+			i = bisect.bisect_right(self.starts, pos) - 1
+			if i not in seen:
+				results.append(self.entries[i])
+				seen.add(i)
+			pos = self.blob.find(needle, self.starts[i] + len(self.keys[i]))
+		return results
+
+
+# Rendered rows, keyed by type path and whether that type is expanded. Only a
+# new object tree invalidates them.
+class FragmentCache:
+	def __init__(self):
+		self.cache = {}
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, path):
+		key = path, path in expanded
+		content = self.cache.get(key)
+		if content is None:
+			self.misses += 1
+			content = self.cache[key] = get_type_content(types[path], key[1])
 		else:
-			bits.append("&nbsp;&nbsp;&nbsp;")
+			self.hits += 1
+		return content
+
+	def evict(self, path):
+		self.cache.pop((path, False), None)
+		self.cache.pop((path, True), None)
+
+	def report(self):
+		if (self.hits or self.misses) and perf.enabled():
+			print("dm-objtree: {} fragments reused, {} rendered".format(self.hits, self.misses))
+		self.hits = self.misses = 0
+
+
+fragments = FragmentCache()
+
+
+def visible_descendants(path, tree=None, opened=None, out=None):
+	if tree is None:
+		tree = types
+	if opened is None:
+		opened = expanded
+	if out is None:
+		out = []
+	for child in tree[path].children:
+		out.append(child.path)
+		if child.path in opened:
+			visible_descendants(child.path, tree, opened, out)
+	return out
+
+
+def get_type_content(ty, is_expanded):
+	path = ty.path
+	bits = [STYLE, "<div style='margin-left: {}em'>".format(2 * (path.count("/") - 1))]
+	if ty.children:
+		if is_expanded:
+			bits.append("<a class='contract' href='contract:{}'>--</a> ".format(path))
+		else:
+			bits.append("<a class='expand' href='expand:{}'>++</a> ".format(path))
+	else:
+		bits.append("&nbsp;&nbsp;&nbsp;")
 
-	link = location_to_href(ty["location"])
+	link = ty.location and location_to_href(ty.location)
 	if link:
-		bits.append("<a class='go' href='{}'>{}</a>".format(link, ty["name"]))
+		bits.append("<a class='go' href='{}'>{}</a>".format(link, ty.name))
 	else:
-		bits.append("<span class='nolink'>{}</a>".format(ty["name"]))
-
-	if ty["children"] and (not ty["name"] or ty["name"] in expanded):
-		bits.append("<ul>")
-		for child in ty["children"]:
-			bits.append("<li>")
-			get_type_content(child, bits)
-			bits.append("</li>")
-		bits.append("</ul>")
+		bits.append("<span class='nolink'>{}</span>".format(ty.name))
+	bits.append("</div>")
+	return "".join(bits)
 
 
 def location_to_href(location):
-	if location["uri"].startswith("file:///"):
-		return "file:{}:{}:{}".format(
-			location["uri"][len("file://"):],
-			location["range"]["start"]["line"],
-			location["range"]["start"]["character"])
-	elif location["uri"].startswith("dm://docs/reference.dm#") and reference_browser:
-		return "dmref:{}".format(location["uri"][len("dm://docs/reference.dm#"):])
+	uri, line, character = location
+	if uri.startswith("file:///"):
+		return "file:{}:{}:{}".format(uri[len("file://"):], line, character)
+	elif uri.startswith("dm://docs/reference.dm#") and reference_browser:
+		return "dmref:{}".format(uri[len("dm://docs/reference.dm#"):])
 
 
 # export interface ObjectTreeParams {
@@ -154,3 +582,6 @@ def location_to_href(location):
 # export interface ObjectTreeProc extends ObjectTreeEntry {
 #     is_verb: boolean | undefined,
 # }
+
+
+_imported()
@@ -0,0 +1,59 @@
+# DreamMaker Language Client - Sublime package for DreamMaker Language Server
+# Copyright (C) 2019  Tad Hardesty
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Commands for inspecting what the package costs.
+
+import sublime_plugin
+
+from .utils import perf
+
+
+PANEL_ID = "DreamMaker Performance"
+
+
+class DreammakerPerformanceStatsCommand(sublime_plugin.WindowCommand):
+	def run(self, reset=False):
+		if reset:
+			perf.reset()
+			self.window.status_message("DreamMaker: performance stats reset")
+			return
+
+		text = perf.report()
+		try:
+			from . import language_client
+		except ImportError:
+			pass
+		else:
+			startup = language_client.startup_report()
+			if startup:
+				text = "Startup: {}\n\n{}".format(startup, text)
+
+		panel = self.window.create_output_panel(PANEL_ID)
+		panel.run_command('append', {'characters': text})
+		self.window.run_command('show_panel', {'panel': 'output.{}'.format(PANEL_ID)})
+
+
+class DreammakerProfileHandlerCommand(sublime_plugin.WindowCommand):
+	def run(self):
+		self.names = sorted(perf.handlers)
+		self.window.show_quick_panel(self.names, self.on_select)
+
+	def on_select(self, index):
+		if index < 0:
+			return
+		name = self.names[index]
+		perf.profile_next.add(name)
+		self.window.status_message("DreamMaker: the next call of {} will be profiled".format(name))
@@ -16,7 +16,17 @@
 
 # File system provider which serves HTML excerpts from the BYOND reference.
 
+from .utils import perf
+_imported = perf.import_timer(__name__)
+
+import os
 import re
+import bisect
+import json
+import hashlib
+import threading
+
+from collections import OrderedDict
 
 import sublime, sublime_plugin
 
@@ -24,17 +34,39 @@ from . import utils
 
 
 def plugin_loaded():
-	RefView.instance = RefView()
+	PageCache.instance = PageCache(os.path.join(utils.cache_path(), 'reference'))
+	if utils.get_config('prewarmReference'):
+		threading.Thread(target=prewarm).start()
+
+
+def prewarm():
+	# Don't pester the user about configuration from a background thread.
+	if not utils.get_config('byondPath'):
+		return
+	info = utils.find_byond_file(['help/ref/info.html'])
+	contents = utils.find_byond_file(['help/ref/contents.html'])
+	if not info or not contents:
+		return
+
+	window = sublime.active_window()
+	window.status_message("DM Reference: indexing...")
+	index = ReferenceIndex.load(info)
+	window.status_message("DM Reference: building index page...")
+	IndexPage.load(contents)
+	window.status_message("DM Reference: ready ({} entries)".format(len(index.names) + len(index.toc_names)))
 
 
 class DreammakerOpenReferenceCommand(sublime_plugin.WindowCommand):
 	def run(self, dm_path=None):
-		RefView.instance.open_view(self.window, dm_path=dm_path)
+		RefView.get().open_view(self.window, dm_path=dm_path)
 
 
 class ReferenceEventListener(sublime_plugin.EventListener):
+	def on_activated(self, view):
+		RefView.claim(view)
+
 	def on_close(self, view):
-		RefView.instance.on_close(view)
+		RefView.release(view)
 
 
 class RefView(utils.HtmlView):
@@ -57,6 +89,7 @@ class RefView(utils.HtmlView):
 		return get_content(dm_path)
 
 
+@perf.timed('reference.render')
 def get_content(dm_path):
 	if dm_path:
 		fname = utils.find_byond_file(['help/ref/info.html'])
@@ -65,77 +98,360 @@ def get_content(dm_path):
 			utils.open_settings()
 			return
 
-		with open(fname, encoding='latin1') as f:
-			contents = f.read()
+		# A page cached on disk is served without reading info.html at all.
+		cache = PageCache.instance
+		content = None
+		digest = cache.digest(fname)
+		if digest:
+			content = cache.get(digest, dm_path)
+		if content is None:
+			index = ReferenceIndex.load(fname)
+			cache.remember_digest(fname, index.stamp, index.digest)
+			body, shown_path = index.lookup(dm_path)
+			content = format_body(convert(body), shown_path)
+			cache.put(index.digest, dm_path, content)
+		return content
+	else:
+		fname = utils.find_byond_file(['help/ref/contents.html'])
+		if not fname:
+			sublime.error_message("A valid Windows BYOND path must be given to use the reference browser.")
+			utils.open_settings()
+			return
+
+		return IndexPage.load(fname).content
+
+
+# Tokens of the reference markup which are rewritten for minihtml. The `amp`
+# lookahead peeks past the tags which are dropped, so that a bare `&` is only
+# escaped when what follows it in the output would not parse as an entity.
+# The leading lookahead lets the scanner skip plain text quickly.
+TOKEN_RE = re.compile(r'''(?=[<&])(?:
+	(?P<list>(?:<dd>)?<dl>(?:<dt>)?)
+	| (?P<end_list></dl>)
+	| (?P<item><d[dt]>)
+	| (?P<drop></d[dt]>)
+	| (?P<li><li>)
+	| (?P<end_li></li>)
+	| (?P<pre><(?:xmp|pre)>)
+	| (?P<end_pre></(?:xmp|pre)>)
+	| <a\ href=(?P<href>[^>]+)>
+	| (?P<shl><<)
+	| (?P<lt><(?=[^/a-zA-Z]))
+	| (?P<amp>&(?!(?:</d[dt]>)*(?:[&\#a-z]|<<|<[^/a-zA-Z]|\Z)))
+)''', re.VERBOSE)
+
+LI, END_LI, DELETED = '<li>', '</li>', ''
+
 
+# Convert a section of the reference to minihtml in a single pass. Definition
+# lists become bulleted lists, runs of list items separated only by whitespace
+# are collapsed, empty items are dropped, stray `<` and `&` are escaped, and
+# <xmp>/<pre> blocks are unwrapped with their newlines turned into <br>.
+def convert(body):
+	out = []
+	pending = None  # list item tag not yet written, for collapsing
+	pre_start = None  # index into `out` where the open <pre> block begins
+
+	def flush():
+		nonlocal pending
+		if pending:
+			out.append(pending)
+		pending = None
+
+	def text(piece):
+		if pending is not None:
+			piece = piece.lstrip()
+			if not piece:
+				return
+			flush()
+		if pre_start is not None:
+			piece = piece.replace("\n", "<br>")
+		out.append(piece)
+
+	def li(tag):
+		nonlocal pending
+		if pending is None:
+			pending = tag
+		elif pending is DELETED:
+			if tag is LI:
+				pending = LI
+		elif pending is not tag:
+			if tag is LI:
+				out.append(pending)
+				pending = LI
+			else:
+				# <li></li> with nothing between is dropped entirely
+				pending = DELETED
+
+	pos = 0
+	for match in TOKEN_RE.finditer(body):
+		start = match.start()
+		if start > pos:
+			if pending is None and pre_start is None:
+				out.append(body[pos:start])
+			else:
+				text(body[pos:start])
+		pos = match.end()
+
+		kind = match.lastgroup
+		if kind == 'list':
+			text("<ul>")
+			li(LI)
+		elif kind == 'end_list':
+			li(END_LI)
+			text("</ul>")
+		elif kind == 'item':
+			li(END_LI)
+			li(LI)
+		elif kind == 'drop':
+			pass
+		elif kind == 'li':
+			li(LI)
+		elif kind == 'end_li':
+			li(END_LI)
+		elif kind == 'pre':
+			if pre_start is None:
+				flush()
+				pre_start = len(out)
+			else:
+				text("<pre>")
+		elif kind == 'end_pre':
+			if pre_start is None:
+				text("</pre>")
+			else:
+				flush()
+				pre_start = None
+		elif kind == 'href':
+			text('<a href="{}">'.format(match.group('href')))
+		elif kind == 'shl':
+			text("&lt;&lt;")
+		elif kind == 'lt':
+			text("&lt;")
+		elif kind == 'amp':
+			text("&amp;")
+
+	if pos < len(body):
+		text(body[pos:])
+	flush()
+	if pre_start is not None:
+		# An unterminated <pre> block swallows the rest of the section
+		del out[pre_start:]
+	return "".join(out)
+
+
+# Memory-resident copy of info.html, with every anchor mapped to the (start,
+# end) offsets of its section. Reloaded when the file's mtime or size changes.
+class ReferenceIndex:
+	ANCHOR_RE = re.compile(r'<a name=([^ >]+)(>| toc=)')
+
+	current = None
+	lock = threading.Lock()
+
+	def __init__(self, fname, stamp, data):
+		self.fname = fname
+		self.stamp = stamp
+		self.digest = hashlib.md5(data).hexdigest()
+		self.contents = contents = data.decode('latin1')
+		self.names = {}
+		self.toc_names = {}
+
+		rules = [m.start() for m in re.finditer('<hr', contents)]
+		for match in self.ANCHOR_RE.finditer(contents):
+			table = self.names if match.group(2) == '>' else self.toc_names
+			if match.group(1) not in table:
+				table[match.group(1)] = self.section(match.start(), rules)
+
+	def lookup(self, dm_path):
 		dm_path = dm_path.replace(">", "&gt;").replace("<", "&lt;")
 
 		# Extract the section for the item being looked up
-		start = contents.find("<a name={}>".format(dm_path))
-		if start < 0:
+		span = self.names.get(dm_path)
+		if span is None:
 			# Handle @dt; and @qu;
-			start = contents.find("<a name={} toc=".format(dm_path))
+			span = self.toc_names.get(dm_path)
 			dm_path = dm_path.replace("@dt;", ".").replace("@qu;", '?')
-		if start < 0:
+		if span is None:
 			# Handle constants which are subordinate to another entry
 			raw_name = dm_path[1 + dm_path.rfind("/"):]
-			start = contents.find(raw_name)
-			start = contents.find("<a name=", start)
+			span = self.find_subordinate(raw_name)
+		if span is None:
+			return "No such entry <tt>{}</tt> in the reference.".format(dm_path), dm_path
+		return self.contents[span[0]:span[1]], dm_path
+
+	def section(self, anchor, rules):
+		start = self.contents.find("\n", anchor)
+		i = bisect.bisect_left(rules, start)
+		end = rules[i] if i < len(rules) else -1
+		return start, end
+
+	def find_subordinate(self, raw_name):
+		start = self.contents.find(raw_name)
+		start = self.contents.find("<a name=", start)
 		if start < 0:
-			body = "No such entry <tt>{}</tt> in the reference.".format(dm_path)
-		else:
-			start = contents.find("\n", start)
-			end = contents.find("<hr", start)
-			body = contents[start:end]
-	else:
-		fname = utils.find_byond_file(['help/ref/contents.html'])
-		if not fname:
-			sublime.error_message("A valid Windows BYOND path must be given to use the reference browser.")
-			utils.open_settings()
-			return
+			return None
+		start = self.contents.find("\n", start)
+		return start, self.contents.find("<hr", start)
+
+	@classmethod
+	def load(cls, fname):
+		stamp = file_stamp(fname)
+		with cls.lock:
+			index = cls.current
+			if index is None or index.fname != fname or index.stamp != stamp:
+				with open(fname, 'rb') as f:
+					index = cls(fname, stamp, f.read())
+				cls.current = index
+		return index
 
-		with open(fname, encoding='latin1') as f:
-			contents = f.read()
 
+# The converted contents.html, which is shown as the reference's index page.
+class IndexPage:
+	current = None
+	lock = threading.Lock()
+
+	def __init__(self, fname, stamp, contents):
+		self.fname = fname
+		self.stamp = stamp
 		body = contents[contents.index("<dl>"):contents.index("</body>")]
+		self.content = format_body(convert(body))
 
-	body = body.replace("<dd><dl>", "<dl>")
-	body = body.replace("<dl><dt>", "<ul><li>")
-	body = body.replace("<dl>", "<ul><li>")
-	body = body.replace("</dl>", "</li></ul>")
-	body = body.replace("<dd>", "</li><li>")
-	body = body.replace("<dt>", "</li><li>")
-	body = body.replace("</dd>", "")
-	body = body.replace("</dt>", "")
-	body = body.replace("<xmp>", "<pre>")
-	body = body.replace("</xmp>", "</pre>")
-	body = re.sub(r'(<li>\s*)+', r'<li>', body)
-	body = re.sub(r'(</li>\s*)+', r'</li>', body)
-	body = re.sub(r'<a href=([^>]+)>', r'<a href="\1">', body)
-	body = body.replace("<<", "&lt;&lt;")
-	body = re.sub(r'<([^/a-zA-Z])', r'&lt;\1', body)
-	body = re.sub(r'&([^&#a-z])', r'&amp;\1', body)
-	body = re.sub(r'<li>\s*</li>', r'', body)
-	body = pre(body)
-
-	return format_body(body, dm_path)
-
-
-def pre(body):
-	output = ''
-	last_pos = 0
-	while True:
-		start = body.find('<pre>', last_pos)
-		if start < 0:
-			output += body[last_pos:]
-			break
-		output += body[last_pos:start]
-		end = body.find('</pre>', start)
-		if end < 0:
-			break
-		output += body[start + len('<pre>'):end].replace("\n", "<br>")
-		last_pos = end + len('</pre>')
-	return output
+	@classmethod
+	def load(cls, fname):
+		stamp = file_stamp(fname)
+		with cls.lock:
+			page = cls.current
+			if page is None or page.fname != fname or page.stamp != stamp:
+				with open(fname, encoding='latin1') as f:
+					page = cls(fname, stamp, f.read())
+				cls.current = page
+		return page
+
+
+def file_stamp(fname):
+	st = os.stat(fname)
+	return st.st_mtime, st.st_size
+
+
+# Converted pages, kept in memory (LRU) and on disk under the cache directory.
+# Entries are keyed by the digest of info.html, so upgrading BYOND or bumping
+# VERSION after changing the conversion discards them.
+class PageCache:
+	VERSION = 1
+	MEMORY_ENTRIES = 64
+	DISK_LIMIT = 16 * 1024 * 1024
+
+	instance = None
+
+	def __init__(self, root):
+		self.root = root
+		self.memory = OrderedDict()
+		self.disk_usage = None
+		self.digests_path = os.path.join(root, 'digests.json')
+		self.digests = None
+
+	# Digests of info.html by path, remembered with its (mtime, size) stamp.
+	def digest(self, fname):
+		if self.digests is None:
+			try:
+				with open(self.digests_path, encoding='utf-8') as f:
+					self.digests = json.load(f)
+			except (OSError, ValueError):
+				self.digests = {}
+		entry = self.digests.get(fname)
+		if entry and entry[:2] == list(file_stamp(fname)):
+			return entry[2]
+
+	def remember_digest(self, fname, stamp, digest):
+		entry = list(stamp) + [digest]
+		if self.digests.get(fname) == entry:
+			return
+		self.digests[fname] = entry
+		try:
+			os.makedirs(self.root, exist_ok=True)
+			with open(self.digests_path, 'w', encoding='utf-8') as f:
+				json.dump(self.digests, f)
+		except OSError as e:
+			print("dm-reference: failed to save digests: {}".format(e))
+
+	def path(self, digest, dm_path):
+		name = hashlib.md5(dm_path.encode('utf-8')).hexdigest()
+		return os.path.join(self.root, 'v{}'.format(self.VERSION), digest, name + '.html')
+
+	def get(self, digest, dm_path):
+		key = digest, dm_path
+		content = self.memory.get(key)
+		if content is not None:
+			self.memory.move_to_end(key)
+			return content
+
+		path = self.path(digest, dm_path)
+		try:
+			with open(path, encoding='utf-8') as f:
+				content = f.read()
+			os.utime(path)
+		except OSError:
+			return None
+		self.remember(key, content)
+		return content
+
+	def put(self, digest, dm_path, content):
+		self.remember((digest, dm_path), content)
+
+		path = self.path(digest, dm_path)
+		try:
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			with open(path, 'w', encoding='utf-8') as f:
+				f.write(content)
+		except OSError as e:
+			print("dm-reference: failed to cache {}: {}".format(dm_path, e))
+			return
+
+		if self.disk_usage is None:
+			self.prune(digest)
+		else:
+			self.disk_usage += os.path.getsize(path)
+			if self.disk_usage > self.DISK_LIMIT:
+				self.prune(digest)
+
+	def remember(self, key, content):
+		self.memory[key] = content
+		self.memory.move_to_end(key)
+		while len(self.memory) > self.MEMORY_ENTRIES:
+			self.memory.popitem(last=False)
+
+	def prune(self, digest):
+		# Drop pages from other versions or BYOND installs, then the least
+		# recently used pages until the cache fits under DISK_LIMIT again.
+		current = os.path.join(self.root, 'v{}'.format(self.VERSION), digest)
+		pages = []
+		for dirpath, dirnames, filenames in os.walk(self.root):
+			for name in filenames:
+				path = os.path.join(dirpath, name)
+				if path == self.digests_path:
+					continue
+				if dirpath != current:
+					remove_quietly(path)
+					continue
+				try:
+					st = os.stat(path)
+				except OSError:
+					continue
+				pages.append((st.st_mtime, st.st_size, path))
+
+		pages.sort()
+		self.disk_usage = sum(size for _, size, _ in pages)
+		for _, size, path in pages:
+			if self.disk_usage <= self.DISK_LIMIT:
+				break
+			remove_quietly(path)
+			self.disk_usage -= size
+
+
+def remove_quietly(path):
+	try:
+		os.remove(path)
+	except OSError:
+		pass
 
 
 def format_body(body, dm_path=None):
@@ -152,3 +468,6 @@ def format_body(body, dm_path=None):
 {body}
 </body>
 </html>""".format(dm_path=dm_path or "/", body=body)
+
+
+_imported()
@@ -0,0 +1,78 @@
+# DreamMaker Language Client - Sublime package for DreamMaker Language Server
+# Copyright (C) 2019  Tad Hardesty
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+# Measures how long the package takes to import and run its plugin_loaded
+# hooks, with 50 windows of 200 views open. Each sample runs in a fresh
+# interpreter. Run from the package directory:
+#
+#     python -m tests.benchmarks.load_time
+
+import sys
+import time
+import importlib
+import statistics
+import subprocess
+
+from . import stubs
+
+
+MODULES = ['language_client', 'build', 'object_tree', 'reference_browser', 'toggle_ticked', 'performance']
+DEFERRED = ['urllib.request', 'gzip', 'subprocess', 'multiprocessing']
+SAMPLES = 10
+
+
+def sample():
+	stubs.install(window_count=50, view_count=200)
+	already = set(name for name in DEFERRED if name in sys.modules)
+
+	start = time.perf_counter()
+	modules = [importlib.import_module('{}.{}'.format(stubs.PACKAGE, name)) for name in MODULES]
+	imported = time.perf_counter()
+
+	# Finding the server command is started from plugin_loaded on a thread,
+	# and may download; it is not part of loading.
+	modules[0].prepare_server_thread = lambda: None
+	for mod in modules:
+		if hasattr(mod, 'plugin_loaded'):
+			mod.plugin_loaded()
+	loaded = time.perf_counter()
+
+	print(imported - start, loaded - imported, stubs.View.name_calls, ','.join(
+		name for name in DEFERRED if name in sys.modules and name not in already) or '-')
+
+
+def main():
+	imports, hooks = [], []
+	for _ in range(SAMPLES):
+		out = subprocess.check_output(
+			[sys.executable, '-m', __spec__.name, '--sample'],
+			cwd=stubs.ROOT, universal_newlines=True)
+		import_time, hook_time, name_calls, loaded = out.split()
+		imports.append(float(import_time))
+		hooks.append(float(hook_time))
+
+	print("import          {:8.1f} ms (median of {})".format(statistics.median(imports) * 1000, SAMPLES))
+	print("plugin_loaded   {:8.1f} ms".format(statistics.median(hooks) * 1000))
+	print("view.name()     {:8} calls".format(name_calls))
+	print("loaded early    {:>8}".format(loaded))
+
+
+if __name__ == '__main__':
+	if '--sample' in sys.argv:
+		sample()
+	else:
+		main()
@@ -0,0 +1,115 @@
+# DreamMaker Language Client - Sublime package for DreamMaker Language Server
+# Copyright (C) 2019  Tad Hardesty
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+# Measures the memory held for a synthetic object tree of 50,000 types, each
+# with 5 vars and 3 procs: first as the decoded JSON of the notification,
+# which is what used to be kept, then as the TypeNodes it is converted to.
+# Run from the package directory:
+#
+#     python -m tests.benchmarks.object_tree_memory
+
+import gc
+import json
+import time
+import random
+import importlib
+import tracemalloc
+
+from . import stubs
+
+
+TYPES = 50000
+VARS = ['name', 'desc', 'icon', 'icon_state', 'density', 'anchored']
+
+
+def location(rnd, fname):
+	line = rnd.randint(1, 2000)
+	return {
+		"uri": "file:///home/user/project/code/{}.dm".format(fname),
+		"range": {"start": {"line": line, "character": 0}, "end": {"line": line, "character": 0}},
+	}
+
+
+def make_type(rnd, name):
+	fname = 'file{}'.format(rnd.randint(0, 3000))
+	return {
+		"name": name,
+		"kind": 5,
+		"location": location(rnd, fname),
+		"vars": [{
+			"name": rnd.choice(VARS + ['var{}'.format(rnd.randint(0, 300))]),
+			"kind": 13,
+			"location": location(rnd, fname),
+			"is_declaration": rnd.random() < 0.3,
+		} for _ in range(5)],
+		"procs": [{
+			"name": 'proc{}'.format(rnd.randint(0, 500)),
+			"kind": 6,
+			"location": location(rnd, fname),
+			"is_verb": False,
+		} for _ in range(3)],
+		"children": [],
+	}
+
+
+def make_tree(count):
+	rnd = random.Random(0)
+	root = make_type(rnd, "")
+	root["location"] = None
+	parents = [root]
+	for i in range(count):
+		child = make_type(rnd, "type{}".format(i))
+		rnd.choice(parents)["children"].append(child)
+		parents.append(child)
+	return {"root": root}
+
+
+def retained():
+	gc.collect()
+	return tracemalloc.get_traced_memory()[0] / 2 ** 20
+
+
+def main():
+	stubs.install()
+	object_tree = importlib.import_module('{}.object_tree'.format(stubs.PACKAGE))
+	text = json.dumps(make_tree(TYPES))
+
+	# Timed separately, as tracemalloc slows allocation down.
+	message = json.loads(text)
+	start = time.perf_counter()
+	object_tree.TypeNode.convert(message["root"], "", {})
+	elapsed = time.perf_counter() - start
+	del message
+
+	tracemalloc.start()
+	message = json.loads(text)
+	raw = retained()
+	types = {}
+	root = object_tree.TypeNode.convert(message["root"], "", types)
+	del message
+	compact = retained()
+	tracemalloc.stop()
+
+	print("types           {:8}".format(len(types)))
+	print("decoded JSON    {:8.1f} MiB".format(raw))
+	print("TypeNodes       {:8.1f} MiB".format(compact))
+	print("conversion      {:8.2f} s".format(elapsed))
+	return root
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,153 @@
+# DreamMaker Language Client - Sublime package for DreamMaker Language Server
+# Copyright (C) 2019  Tad Hardesty
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+# Stand-ins for the sublime, sublime_plugin and LSP modules, so the benchmarks
+# in this directory can load the package with a plain Python interpreter.
+
+import os
+import sys
+import types
+import tempfile
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PACKAGE = 'dreammaker'
+
+
+class Settings(dict):
+	def set(self, key, value):
+		self[key] = value
+
+	def add_on_change(self, key, callback):
+		pass
+
+	def clear_on_change(self, key):
+		pass
+
+
+class View:
+	name_calls = 0
+
+	def __init__(self, view_id):
+		self.view_id = view_id
+		self._settings = Settings()
+
+	def id(self):
+		return self.view_id
+
+	def name(self):
+		View.name_calls += 1
+		return 'file{}.dm'.format(self.view_id)
+
+	def file_name(self):
+		return None
+
+	def is_scratch(self):
+		return False
+
+	def settings(self):
+		return self._settings
+
+
+class Window:
+	def __init__(self, window_id, view_count):
+		self.window_id = window_id
+		self._views = [View(window_id * view_count + i) for i in range(view_count)]
+
+	def id(self):
+		return self.window_id
+
+	def views(self):
+		return self._views
+
+	def active_view(self):
+		return self._views[0] if self._views else None
+
+	def folders(self):
+		return []
+
+	def status_message(self, message):
+		pass
+
+
+class Stub:
+	def __init__(self, *args, **kwargs):
+		self.args = args
+		self.__dict__.update(kwargs)
+
+
+def module(name, **attrs):
+	mod = types.ModuleType(name)
+	mod.__dict__.update(attrs)
+	sys.modules[name] = mod
+	return mod
+
+
+# Installs the stand-ins, with the given number of windows each holding the
+# given number of views, and returns the windows.
+def install(window_count=1, view_count=1):
+	windows = [Window(i, view_count) for i in range(window_count)]
+	cache = tempfile.mkdtemp()
+	settings = {}
+
+	def load_settings(name):
+		return settings.setdefault(name, Settings())
+
+	module(
+		'sublime',
+		load_settings=load_settings,
+		save_settings=lambda name: None,
+		cache_path=lambda: cache,
+		windows=lambda: windows,
+		active_window=lambda: windows[0],
+		set_timeout=lambda callback, delay=0: callback(),
+		set_timeout_async=lambda callback, delay=0: callback(),
+		platform=lambda: 'linux',
+		arch=lambda: 'x64',
+		version=lambda: '3211',
+		status_message=lambda message: None,
+		error_message=lambda message: None,
+		Region=Stub,
+		Phantom=Stub,
+		PhantomSet=Stub,
+		LAYOUT_INLINE=0,
+		LAYOUT_BELOW=1,
+		LAYOUT_BLOCK=2,
+		ENCODED_POSITION=1,
+		TRANSIENT=4,
+		KEEP_OPEN_ON_FOCUS_LOST=2,
+		DRAW_NO_FILL=32,
+		DRAW_NO_OUTLINE=256,
+	)
+	module(
+		'sublime_plugin',
+		EventListener=object,
+		TextCommand=Stub,
+		WindowCommand=Stub,
+	)
+	module('LSP', __path__=[])
+	module('LSP.plugin', __path__=[])
+	core = module('LSP.plugin.core', __path__=[])
+	module('LSP.plugin.core.handlers', LanguageHandler=object)
+	module('LSP.plugin.core.settings', ClientConfig=Stub, LanguageConfig=Stub)
+	module('LSP.plugin.core.protocol', Notification=Stub)
+	core.sessions = module('LSP.plugin.core.sessions')
+
+	# The package directory's name has spaces once installed, so it is
+	# registered under a plain name instead of being found on sys.path.
+	module(PACKAGE, __path__=[ROOT])
+	return windows
@@ -0,0 +1,130 @@
+# DreamMaker Language Client - Sublime package for DreamMaker Language Server
+# Copyright (C) 2019  Tad Hardesty
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+from .. import build
+from ..build import BuildCache, Uncacheable
+
+
+DME = """// DM Environment file for game.dme.
+#define DEBUG
+#define FILE_DIR icons
+// BEGIN_INCLUDE
+#include "code\\game.dm"
+// END_INCLUDE
+"""
+
+
+class TestBuildCache(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.dir)
+		patcher = mock.patch.object(build.utils, 'cache_path', lambda: os.path.join(self.dir, 'cache'))
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+		self.project = os.path.join(self.dir, 'project')
+		self.dme = os.path.join(self.project, 'game.dme')
+		self.exe = os.path.join(self.dir, 'DreamMaker')
+		self.write('../DreamMaker', '#!/bin/sh\n')
+		self.write('game.dme', DME)
+		self.write('code/game.dm', '#include "maps/_basemap.dm"\n/mob/icon = \'mob.dmi\'\n')
+		self.write('code/maps/_basemap.dm', '#include "station.dmm"\n')
+		self.write('code/maps/station.dmm', '"a" = (/turf)\n')
+		self.write('icons/mob.dmi', 'icon v1')
+
+	def write(self, name, text):
+		path = os.path.join(self.project, name.replace('/', os.sep))
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path, 'w') as f:
+			f.write(text)
+		# Make the change visible even within the filesystem's mtime resolution.
+		st = os.stat(path)
+		os.utime(path, (st.st_atime, st.st_mtime + len(text)))
+
+	def build(self, output='game.dmb - 0 errors, 0 warnings'):
+		cache = BuildCache(self.dme, self.exe)
+		cache.compute()
+		self.write('game.dmb', 'dmb')
+		cache.save(output)
+
+	def up_to_date(self):
+		cache = BuildCache(self.dme, self.exe)
+		cache.compute()
+		return cache.up_to_date()
+
+	def test_unchanged(self):
+		self.build()
+		cache = BuildCache(self.dme, self.exe)
+		cache.compute()
+		self.assertTrue(cache.up_to_date())
+		self.assertEqual(cache.output, 'game.dmb - 0 errors, 0 warnings')
+		self.assertEqual(sorted(cache.files), sorted(os.path.normpath(each) for each in [
+			'game.dme',
+			'code/game.dm',
+			'code/maps/_basemap.dm',
+			'code/maps/station.dmm',
+			'mob.dmi',
+			'icons/mob.dmi',
+		]))
+
+	def test_nested_include_changed(self):
+		self.build()
+		self.write('code/maps/station.dmm', '"a" = (/turf/space)\n')
+		self.assertFalse(self.up_to_date())
+
+	def test_resource_changed(self):
+		self.build()
+		self.write('icons/mob.dmi', 'icon v2')
+		self.assertFalse(self.up_to_date())
+
+	def test_resource_shadowed(self):
+		self.build()
+		self.write('mob.dmi', 'icon found first')
+		self.assertFalse(self.up_to_date())
+
+	def test_compiler_changed(self):
+		self.build()
+		self.exe = os.path.join(self.dir, 'other', 'DreamMaker')
+		os.makedirs(os.path.dirname(self.exe))
+		shutil.copy(os.path.join(self.dir, 'DreamMaker'), self.exe)
+		self.assertFalse(self.up_to_date())
+
+	def test_compiler_updated(self):
+		self.build()
+		self.write('../DreamMaker', '#!/bin/sh\nexit 0\n')
+		self.assertFalse(self.up_to_date())
+
+	def test_no_markers(self):
+		self.write('game.dme', '#include "code\\game.dm"\n')
+		with self.assertRaises(Uncacheable):
+			self.build()
+
+	def test_include_outside_markers(self):
+		self.write('game.dme', DME + '#include "code\\extra.dm"\n')
+		with self.assertRaises(Uncacheable):
+			self.build()
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,74 @@
+# DreamMaker Language Client - Sublime package for DreamMaker Language Server
+# Copyright (C) 2019  Tad Hardesty
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import time
+import threading
+import unittest
+
+from ..build import read_output
+
+
+class TestReadOutput(unittest.TestCase):
+	def read(self, pieces, encoding='utf-8', chunk_size=2 ** 16):
+		r, w = os.pipe()
+
+		# Written from another thread, with pauses, so each piece arrives in
+		# its own read.
+		def writer():
+			try:
+				for piece in pieces:
+					os.write(w, piece)
+					time.sleep(0.05)
+			finally:
+				os.close(w)
+		thread = threading.Thread(target=writer)
+		thread.start()
+		try:
+			results = list(read_output(r, encoding, chunk_size))
+		finally:
+			thread.join()
+			os.close(r)
+		return results
+
+	def test_split_sequences(self):
+		text = "café ☃ \U0001F600 done\n"
+		data = text.encode('utf-8')
+		# Split inside the two-, three- and four-byte sequences.
+		cuts = [4, 8, 9, 12, 13, 14, len(data)]
+		pieces = [data[a:b] for a, b in zip([0] + cuts, cuts)]
+		results = self.read(pieces)
+		self.assertEqual("".join(text for text, final in results), text)
+		self.assertEqual([final for text, final in results], [False] * (len(results) - 1) + [True])
+
+	def test_invalid_byte(self):
+		results = self.read([b"before \xff after\n", b"more\n", b"end"])
+		self.assertEqual("".join(text for text, final in results), "before \ufffd after\nmore\nend")
+		self.assertTrue(results[-1][1])
+
+	def test_truncated_sequence_at_eof(self):
+		results = self.read([b"tail \xe2\x98"])
+		self.assertEqual("".join(text for text, final in results), "tail \ufffd")
+
+	def test_small_chunks(self):
+		text = "é☃" * 100
+		results = self.read([text.encode('utf-8')], chunk_size=3)
+		self.assertEqual("".join(text for text, final in results), text)
+
+
+if __name__ == '__main__':
+	unittest.main()
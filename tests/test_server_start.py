@@ -0,0 +1,86 @@
+# DreamMaker Language Client - Sublime package for DreamMaker Language Server
+# Copyright (C) 2019  Tad Hardesty
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+# Startup while the server command is still being prepared: the client must be
+# started through LSP once the command is known, without a view being
+# activated.
+
+import sys
+import types
+import unittest
+
+from unittest import mock
+
+from .. import language_client, utils
+from ..language_client import LspDreammakerPlugin
+
+
+class Window:
+	def id(self):
+		return 1
+
+
+class WindowManager:
+	def __init__(self, plugin, window):
+		self.plugin = plugin
+		self.window = window
+		self.started = []
+
+	def start_active_views(self):
+		self.started.append(self.plugin.on_start(self.window))
+
+
+class TestStart(unittest.TestCase):
+	def setUp(self):
+		self.plugin = LspDreammakerPlugin()
+		self.window = Window()
+		self.manager = WindowManager(self.plugin, self.window)
+		registry = types.ModuleType('LSP.plugin.core.registry')
+		registry.windows = mock.Mock()
+		registry.windows.lookup.return_value = self.manager
+
+		for patcher in [
+			mock.patch.dict(sys.modules, {'LSP.plugin.core.registry': registry}),
+			mock.patch.object(language_client, 'server_ready', utils.Ready()),
+			mock.patch.object(utils.sublime, 'set_timeout', lambda callback, delay=0: callback()),
+			mock.patch.object(LspDreammakerPlugin, 'instances', {}),
+			mock.patch.object(LspDreammakerPlugin, 'waiting', set()),
+			mock.patch.object(LspDreammakerPlugin, 'last_instance', None),
+		]:
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	def test_started_when_ready(self):
+		self.assertFalse(self.plugin.on_start(self.window))
+		self.assertFalse(self.plugin.on_start(self.window))
+		self.assertEqual(len(language_client.server_ready.callbacks), 1)
+
+		language_client.server_ready.set('dm-langserver')
+		self.assertEqual(self.manager.started, [True])
+		self.assertIn(self.window.id(), LspDreammakerPlugin.instances)
+		self.assertFalse(LspDreammakerPlugin.waiting)
+
+	def test_no_command(self):
+		self.assertFalse(self.plugin.on_start(self.window))
+		language_client.server_ready.set(None)
+		self.assertEqual(self.manager.started, [])
+		self.assertFalse(self.plugin.on_start(self.window))
+		self.assertNotIn(self.window.id(), LspDreammakerPlugin.instances)
+
+
+if __name__ == '__main__':
+	unittest.main()
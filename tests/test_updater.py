@@ -0,0 +1,155 @@
+# DreamMaker Language Client - Sublime package for DreamMaker Language Server
+# Copyright (C) 2019  Tad Hardesty
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+# Runs the updater against a local HTTP server standing in for the update
+# endpoint.
+
+import os
+import bz2
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from unittest import mock
+
+from .. import language_client
+
+
+def offtout(value):
+	data = abs(value).to_bytes(8, 'little')
+	if value < 0:
+		data = data[:7] + bytes([data[7] | 0x80])
+	return data
+
+
+# A patch with a single control entry: add diff bytes over the start of the
+# old file, then append the rest of the new file as extra bytes.
+def make_patch(old, new):
+	shared = min(len(old), len(new))
+	diff = bytes((n - o) & 0xff for o, n in zip(old[:shared], new[:shared]))
+	extra = new[shared:]
+	ctrl = bz2.compress(offtout(shared) + offtout(len(extra)) + offtout(0))
+	diff = bz2.compress(diff)
+	return b"BSDIFF40" + offtout(len(ctrl)) + offtout(len(diff)) + offtout(len(new)) + ctrl + diff + bz2.compress(extra)
+
+
+def md5(data):
+	return hashlib.md5(data).hexdigest()
+
+
+class UpdateHandler(BaseHTTPRequestHandler):
+	def log_message(self, *args):
+		pass
+
+	def do_GET(self):
+		server = self.server
+		query = parse_qs(urlparse(self.path).query)
+		server.requests.append(query)
+
+		if server.always_patch or ('patch' in query and query['hash'][0] == md5(server.old)):
+			body = server.patch
+		else:
+			body = server.new
+		self.send_response(200)
+		self.send_header('X-Target-Hash', server.target_hash)
+		if body is not server.new:
+			self.send_header('X-Patch-Format', 'bsdiff40')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+class TestAutoUpdate(unittest.TestCase):
+	def setUp(self):
+		self.server = HTTPServer(('127.0.0.1', 0), UpdateHandler)
+		self.server.requests = []
+		self.server.always_patch = False
+		self.server.old = bytes(range(256)) * 64
+		self.server.new = bytes(reversed(self.server.old[:10000])) + b"new version"
+		self.server.patch = make_patch(self.server.old, self.server.new)
+		self.server.target_hash = md5(self.server.new)
+		threading.Thread(target=self.server.serve_forever).start()
+
+		self.dir = tempfile.mkdtemp()
+		self.base_file = os.path.join(self.dir, 'dm-langserver')
+		self.out_file = self.base_file + '.update'
+		with open(self.base_file, 'wb') as f:
+			f.write(self.server.old)
+
+		url = "http://127.0.0.1:{}/update.php".format(self.server.server_port)
+		for patcher in [
+			mock.patch.object(language_client, 'UPDATE_URL', url),
+			mock.patch.object(language_client, 'config_auto_update', lambda hash: True),
+			mock.patch.object(language_client, 'download_progress', lambda done, total: None),
+			mock.patch.object(language_client, 'status_text', ''),
+			mock.patch.object(language_client, 'update_available', False),
+			mock.patch.object(language_client.sublime, 'active_window'),
+		]:
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		shutil.rmtree(self.dir)
+
+	def update(self):
+		return language_client.auto_update('linux', 'x64', self.out_file, md5(self.server.old), self.base_file)
+
+	def read_update(self):
+		with open(self.out_file, 'rb') as f:
+			return f.read()
+
+	def test_patch(self):
+		self.assertIsNone(self.update())
+		self.assertEqual(self.read_update(), self.server.new)
+		self.assertEqual(len(self.server.requests), 1)
+		self.assertEqual(self.server.requests[0]['patch'], ['bsdiff40'])
+		self.assertEqual(sorted(os.listdir(self.dir)), ['dm-langserver', 'dm-langserver.update'])
+
+	def test_corrupt_patch_falls_back(self):
+		patch = self.server.patch
+		self.server.patch = patch[:40] + b"x" * (len(patch) - 40)
+		self.assertIsNone(self.update())
+		self.assertEqual(self.read_update(), self.server.new)
+		self.assertEqual(len(self.server.requests), 2)
+		self.assertNotIn('patch', self.server.requests[1])
+		self.assertEqual(sorted(os.listdir(self.dir)), ['dm-langserver', 'dm-langserver.update'])
+
+	def test_hash_mismatch_rejected(self):
+		self.server.target_hash = md5(b"something else")
+		self.assertEqual(self.update(), "Downloaded file is corrupt.")
+		# The patched file failed the check too, before the full download.
+		self.assertEqual(len(self.server.requests), 2)
+		self.assertEqual(os.listdir(self.dir), ['dm-langserver'])
+		self.assertFalse(language_client.update_available)
+
+	def test_patch_to_full_request_rejected(self):
+		self.server.always_patch = True
+		self.server.patch = b"not a patch"
+		self.assertEqual(self.update(), "Server sent a patch when the full file was requested.")
+		self.assertEqual(len(self.server.requests), 2)
+		self.assertNotIn('patch', self.server.requests[1])
+		self.assertEqual(os.listdir(self.dir), ['dm-langserver'])
+
+
+if __name__ == '__main__':
+	unittest.main()
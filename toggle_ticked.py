@@ -20,6 +20,7 @@ import os
 import sublime, sublime_plugin
 
 from . import utils
+from .utils import perf
 
 
 STATUS_KEY = "dreammaker_ticked"
@@ -50,6 +51,7 @@ class DmInternalToggleTickedCommand(sublime_plugin.TextCommand):
 
 
 class TickStatusEventListener(sublime_plugin.EventListener):
+	@perf.timed('tick_status.on_activated')
 	def on_activated(self, view):
 		update_ticked_status(view)
 
@@ -209,5 +211,5 @@ class EnvironmentFile:
 				env.includes.append(line[len(EnvironmentFile.PREFIX) : -len(EnvironmentFile.SUFFIX)])
 			# junk lines in the INCLUDE section are discarded
 		for line in input:
-			env.footer.push(line)
+			env.footer.append(line)
 		return env
@@ -16,13 +16,15 @@
 
 # 'utils' package
 import os
+import re
 import stat
+import shutil
 import sublime
 import hashlib
 import webbrowser
 import time
 
-from threading import Condition, Thread
+from threading import Condition, Event, Lock, Thread
 
 
 def is_executable(path):
@@ -36,7 +38,8 @@ def is_executable(path):
 def md5_file(path):
 	h = hashlib.new('md5')
 	with open(path, 'rb') as f:
-		h.update(f.read())
+		for chunk in iter(lambda: f.read(2 ** 16), b''):
+			h.update(chunk)
 	return h.hexdigest()
 
 
@@ -44,13 +47,63 @@ def cache_path():
 	return os.path.join(sublime.cache_path(), 'DreamMaker Language Client')
 
 
+# The package settings. Values are read from Sublime once and then kept up to
+# date by an on_change callback, which also notifies whoever subscribed to
+# the keys that changed.
+class Settings:
+	NAME = "dreammaker.sublime-settings"
+
+	def __init__(self):
+		self.settings = None
+		self.values = {}
+		self.subscribers = {}
+		self.lock = Lock()
+
+	def load(self):
+		# load_settings only works once the API is ready, so wait for first use.
+		with self.lock:
+			if self.settings is None:
+				self.settings = sublime.load_settings(self.NAME)
+				self.settings.add_on_change('dreammaker_utils', self.on_change)
+			return self.settings
+
+	def get(self, name, default=None):
+		try:
+			value = self.values[name]
+		except KeyError:
+			value = self.values[name] = self.load().get(name)
+		return default if value is None else value
+
+	def set(self, name, value):
+		self.load().set(name, value)
+		sublime.save_settings(self.NAME)
+
+	def subscribe(self, name, callback):
+		self.subscribers.setdefault(name, []).append(callback)
+
+	def unsubscribe(self, name, callback):
+		self.subscribers.get(name, []).remove(callback)
+
+	def on_change(self):
+		old = self.values
+		new = {name: self.settings.get(name) for name in old}
+		self.values = new
+		for name, callbacks in list(self.subscribers.items()):
+			# Keys which were never read can't be compared, so count as changed.
+			if name not in old or old[name] != new[name]:
+				for callback in list(callbacks):
+					callback()
+
+
+settings = Settings()
+
+
 def get_config(name, default=None):
-	return sublime.load_settings("dreammaker.sublime-settings").get(name, default)
+	return settings.get(name, default)
 
 
 def set_config(name, value):
-	sublime.load_settings("dreammaker.sublime-settings").set(name, value)
-	sublime.save_settings("dreammaker.sublime-settings")
+	settings.set(name, value)
 
 
 def open_config():
@@ -60,11 +113,11 @@ def open_config():
 	})
 
 
-def find_byond_file(nameset):
-	opt = get_config('byondPath')
-	if isinstance(opt, str):
-		opt = [opt]
-	if not opt:
+# With `executable`, only installs which can actually run the file are used:
+# those found in a Wine prefix need Wine itself to be installed.
+def find_byond_file(nameset, executable=False):
+	installs = byond_installs()
+	if installs is None:
 		sublime.error_message("A BYOND path must be provided to use this feature.")
 		open_config()
 		return
@@ -72,12 +125,105 @@ def find_byond_file(nameset):
 	if isinstance(nameset, str):
 		nameset = [nameset]
 
-	for each in opt:
+	for install in installs:
+		if executable and install.wine_prefix and not install.wine:
+			continue
 		for name in nameset:
-			binary = "{}/{}".format(each, name)
-			if os.path.exists(binary):
+			binary = install.find(name)
+			if binary:
 				return binary
 
+	# Look again next time, in case BYOND has been installed since.
+	forget_byond_installs()
+
+
+# A BYOND installation found through "byondPath". Whether each file exists
+# is remembered, so that repeated lookups don't touch the filesystem.
+class ByondInstall:
+	def __init__(self, path, wine_prefix=None, wine=None):
+		self.path = path
+		self.wine_prefix = wine_prefix
+		self.wine = wine  # the wine binary, for installs in a Wine prefix
+		self.binaries = {}
+
+	def find(self, name):
+		try:
+			return self.binaries[name]
+		except KeyError:
+			pass
+		binary = "{}/{}".format(self.path, name)
+		found = binary if os.path.exists(binary) else None
+		self.binaries[name] = found
+		return found
+
+	def contains(self, path):
+		return os.path.normcase(path).startswith(os.path.normcase(self.path + "/"))
+
+
+_byond_installs = None
+_byond_lock = Lock()
+
+WINDOWS_PATH_RE = re.compile(r'^([A-Za-z]):[/\\](.*)$')
+
+
+def byond_installs():
+	global _byond_installs
+	with _byond_lock:
+		if _byond_installs is not None:
+			return _byond_installs
+
+		opt = settings.get('byondPath')
+		if isinstance(opt, str):
+			opt = [opt]
+		if not opt:
+			return None
+
+		installs = []
+		for each in opt:
+			each = each.rstrip("/\\")
+			if os.path.isdir(each):
+				installs.append(ByondInstall(each))
+			if sublime.platform() != "windows":
+				installs.extend(wine_installs(each))
+		_byond_installs = installs
+		return installs
+
+
+def forget_byond_installs():
+	global _byond_installs
+	with _byond_lock:
+		_byond_installs = None
+
+
+settings.subscribe('byondPath', forget_byond_installs)
+
+
+def byond_install_of(path):
+	for install in byond_installs() or ():
+		if install.contains(path):
+			return install
+
+
+# "C:/Program Files/BYOND" also refers to that folder within each Wine prefix.
+def wine_installs(path):
+	match = WINDOWS_PATH_RE.match(path)
+	if not match:
+		return []
+	drive, rest = match.groups()
+
+	prefixes = []
+	for prefix in (os.environ.get('WINEPREFIX'), os.path.expanduser("~/.wine")):
+		if prefix and prefix not in prefixes:
+			prefixes.append(prefix)
+
+	wine = shutil.which('wine')
+	installs = []
+	for prefix in prefixes:
+		mapped = os.path.join(prefix, "drive_{}".format(drive.lower()), rest.replace("\\", "/"))
+		if os.path.isdir(mapped):
+			installs.append(ByondInstall(mapped, prefix, wine))
+	return installs
+
 
 def when_view_loaded(view, callback):
 	if view.is_loading():
@@ -105,7 +251,113 @@ class Promise:
 			return self.result
 
 
+# A value which becomes available once, later. Callbacks subscribed before
+# then are run on the main thread when it arrives; ones subscribed after are
+# run right away.
+class Ready:
+	def __init__(self):
+		self.event = Event()
+		self.lock = Lock()
+		self.callbacks = []
+		self.value = None
+
+	def set(self, value):
+		with self.lock:
+			self.value = value
+			self.event.set()
+			callbacks, self.callbacks = self.callbacks, []
+		for callback in callbacks:
+			sublime.set_timeout(lambda callback=callback: callback(value), 0)
+
+	def is_set(self):
+		return self.event.is_set()
+
+	def wait(self, timeout=None):
+		self.event.wait(timeout)
+		return self.value
+
+	def subscribe(self, callback):
+		with self.lock:
+			if not self.event.is_set():
+				self.callbacks.append(callback)
+				return
+		sublime.set_timeout(lambda: callback(self.value), 0)
+
+
+# The views opened by HtmlView subclasses, keyed by (window id, name). The
+# views are tagged with a setting, which sessions preserve, so those left
+# over from the last session are found by looking through every view once.
+# After that, the registry is kept up to date by each subclass's listener.
+class ViewRegistry:
+	SETTING = "dreammaker_html_view"
+
+	views = {}
+	scanned = False
+
+	@classmethod
+	def add(cls, view, name):
+		window = view.window()
+		cls.remove(view)
+		cls.views[window.id() if window else None, name] = view
+
+	@classmethod
+	def remove(cls, view):
+		for key, each in list(cls.views.items()):
+			if each.id() == view.id():
+				del cls.views[key]
+
+	@classmethod
+	def find(cls, name):
+		if not cls.scanned:
+			cls.scan()
+		for (window_id, each), view in list(cls.views.items()):
+			if each == name:
+				if view.is_valid():
+					return view
+				del cls.views[window_id, each]
+
+	@classmethod
+	def scan(cls):
+		cls.scanned = True
+		names = set(subclass.name for subclass in HtmlView.__subclasses__())
+		for window in sublime.windows():
+			for view in window.views():
+				name = view.settings().get(cls.SETTING)
+				if name is None and view.is_scratch() and view.name() in names:
+					# Opened by a version from before views were tagged.
+					name = view.name()
+					view.settings().set(cls.SETTING, name)
+				if name is not None:
+					cls.views[window.id(), name] = view
+
+
+# Each subclass has one instance, which is only created when first needed.
 class HtmlView:
+	_instance = None
+
+	@classmethod
+	def get(cls):
+		if cls._instance is None:
+			cls._instance = cls()
+		return cls._instance
+
+	# Called when any view is activated. One of ours left over from the last
+	# session is filled in again when shown.
+	@classmethod
+	def claim(cls, view):
+		if view.settings().get(ViewRegistry.SETTING) != cls.name:
+			return
+		ViewRegistry.add(view, cls.name)
+		if cls._instance is None:
+			cls.get()
+
+	# Called when any view is closed.
+	@classmethod
+	def release(cls, view):
+		ViewRegistry.remove(view)
+		if cls._instance is not None:
+			cls._instance.on_close(view)
+
 	def __init__(self):
 		self.view = None
 		self.phantom_set = None
@@ -115,13 +367,11 @@ class HtmlView:
 		assert self.name
 
 	def reclaim_view(self):
-		for window in sublime.windows():
-			for view in window.views():
-				if view.name() == self.name:
-					self.view = view
-					self.phantom_set = sublime.PhantomSet(self.view, self.phantom_set_key)
-					self.update()
-					return
+		view = ViewRegistry.find(self.name)
+		if view:
+			self.view = view
+			self.phantom_set = sublime.PhantomSet(self.view, self.phantom_set_key)
+			self.update()
 
 	def open_view(self, window, **kwargs):
 		if not self.view:
@@ -129,6 +379,8 @@ class HtmlView:
 			self.view.set_scratch(True)
 			self.view.set_read_only(True)
 			self.view.set_name(self.name)
+			self.view.settings().set(ViewRegistry.SETTING, self.name)
+			ViewRegistry.add(self.view, self.name)
 			self.phantom_set = sublime.PhantomSet(self.view, self.phantom_set_key)
 		self.update(**kwargs)
 		window.focus_view(self.view)
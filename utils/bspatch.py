@@ -0,0 +1,151 @@
+# DreamMaker Language Client - Sublime package for DreamMaker Language Server
+# Copyright (C) 2019  Tad Hardesty
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Applies patches in the BSDIFF40 format produced by Colin Percival's bsdiff.
+#
+# A patch is a 32-byte header followed by three bzip2 streams: control
+# triples (x, y, z), "diff" bytes and "extra" bytes. Each triple adds the
+# next x diff bytes to the old file at the current position, copies the
+# next y extra bytes, then seeks the old file by z.
+
+import bz2
+import hashlib
+import io
+import os
+import tempfile
+
+
+MAGIC = b"BSDIFF40"
+CHUNK_SIZE = 2 ** 20
+
+
+class PatchError(Exception):
+	pass
+
+
+# bsdiff's integers are little-endian sign-magnitude.
+def offtin(buf):
+	y = int.from_bytes(buf[:8], 'little')
+	if y & (1 << 63):
+		y = -(y & ~(1 << 63))
+	return y
+
+
+# Bytewise addition modulo 256, done with big integers rather than a Python
+# loop per byte: the low seven bits of each byte are added without carrying
+# into the next byte, and the high bit is the XOR of both high bits.
+def add_bytes(a, b):
+	n = len(a)
+	if not n:
+		return b""
+	low = int.from_bytes(b"\x7f" * n, 'little')
+	high = int.from_bytes(b"\x80" * n, 'little')
+	x = int.from_bytes(a, 'little')
+	y = int.from_bytes(b, 'little')
+	return (((x & low) + (y & low)) ^ ((x ^ y) & high)).to_bytes(n, 'little')
+
+
+def read_exact(stream, n):
+	data = stream.read(n)
+	if len(data) != n:
+		raise PatchError("Corrupt patch: block ended early")
+	return data
+
+
+# Patch `old_file` with the patch in `patch_file`, atomically writing the
+# result to `out_file`. Returns the MD5 of the new file.
+def apply_patch(old_file, patch_file, out_file):
+	with open(patch_file, 'rb') as f:
+		patch = f.read()
+	if len(patch) < 32 or patch[:8] != MAGIC:
+		raise PatchError("Not a BSDIFF40 patch")
+	ctrl_len = offtin(patch[8:16])
+	diff_len = offtin(patch[16:24])
+	new_size = offtin(patch[24:32])
+	if ctrl_len < 0 or diff_len < 0 or new_size < 0 or 32 + ctrl_len + diff_len > len(patch):
+		raise PatchError("Corrupt patch: bad header")
+
+	blocks = [
+		patch[32:32 + ctrl_len],
+		patch[32 + ctrl_len:32 + ctrl_len + diff_len],
+		patch[32 + ctrl_len + diff_len:],
+	]
+	try:
+		ctrl, diff, extra = [bz2.BZ2File(io.BytesIO(block)) for block in blocks]
+	except (OSError, EOFError) as e:
+		raise PatchError("Corrupt patch: {}".format(e))
+
+	with open(old_file, 'rb') as f:
+		old = f.read()
+
+	h = hashlib.new('md5')
+	fd, temp = tempfile.mkstemp(dir=os.path.dirname(out_file) or '.', suffix='.part')
+	try:
+		with os.fdopen(fd, 'wb') as out:
+			def write(data):
+				h.update(data)
+				out.write(data)
+
+			new_pos = old_pos = 0
+			while new_pos < new_size:
+				control = read_exact(ctrl, 24)
+				x, y, z = offtin(control[0:8]), offtin(control[8:16]), offtin(control[16:24])
+				if x < 0 or y < 0 or new_pos + x + y > new_size:
+					raise PatchError("Corrupt patch: bad control entry")
+
+				# Add x diff bytes to the old data, or to zeroes where the old
+				# position is outside the old file.
+				while x:
+					n = min(x, CHUNK_SIZE)
+					data = read_exact(diff, n)
+					start = min(max(old_pos, 0), len(old))
+					end = min(max(old_pos + n, 0), len(old))
+					if start == end:
+						write(data)
+					else:
+						before = start - old_pos
+						write(data[:before])
+						write(add_bytes(old[start:end], data[before:before + end - start]))
+						write(data[before + end - start:])
+					new_pos += n
+					old_pos += n
+					x -= n
+
+				while y:
+					n = min(y, CHUNK_SIZE)
+					write(read_exact(extra, n))
+					new_pos += n
+					y -= n
+
+				old_pos += z
+
+			os.chmod(temp, os.stat(old_file).st_mode)
+		os.replace(temp, out_file)
+	except (OSError, EOFError) as e:
+		remove_quietly(temp)
+		raise PatchError("Failed to apply patch: {}".format(e))
+	except BaseException:
+		remove_quietly(temp)
+		raise
+
+	return h.hexdigest()
+
+
+def remove_quietly(path):
+	try:
+		os.remove(path)
+	except OSError:
+		pass
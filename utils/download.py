@@ -0,0 +1,88 @@
+# DreamMaker Language Client - Sublime package for DreamMaker Language Server
+# Copyright (C) 2019  Tad Hardesty
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Streaming downloads: the response is decompressed, hashed and written to
+# disk a chunk at a time, so memory use doesn't depend on the file size.
+
+import os
+import stat
+import time
+import zlib
+import hashlib
+import tempfile
+
+
+CHUNK_SIZE = 2 ** 16
+PROGRESS_INTERVAL = 0.25  # seconds
+
+ENCODINGS = (None, 'identity', 'gzip')
+
+
+# Write the body of `res` to `out_file`, returning the MD5 of what was
+# written. The data goes to a temporary file next to `out_file` which only
+# replaces it once complete. `progress(done, total)` is called now and then
+# with byte counts of the response as sent; `total` is None if unknown.
+def download(res, out_file, progress=None, executable=False):
+	encoding = res.headers.get('Content-encoding')
+	if encoding not in ENCODINGS:
+		raise ValueError("Unknown Content-encoding: {}".format(encoding))
+	decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if encoding == 'gzip' else None
+
+	total = res.headers.get('Content-length')
+	total = int(total) if total and total.isdigit() else None
+
+	h = hashlib.new('md5')
+	fd, temp = tempfile.mkstemp(dir=os.path.dirname(out_file) or '.', suffix='.part')
+	try:
+		with os.fdopen(fd, 'wb') as stream, res:
+			done = 0
+			reported = time.time()
+			while True:
+				chunk = res.read(CHUNK_SIZE)
+				if not chunk:
+					break
+				done += len(chunk)
+				if decompressor:
+					chunk = decompressor.decompress(chunk)
+				h.update(chunk)
+				stream.write(chunk)
+
+				if progress and time.time() - reported >= PROGRESS_INTERVAL:
+					reported = time.time()
+					progress(done, total)
+
+			if decompressor:
+				chunk = decompressor.flush()
+				h.update(chunk)
+				stream.write(chunk)
+				if not decompressor.eof:
+					raise EOFError("Download ended in the middle of the gzip stream")
+			if total is not None and done < total:
+				raise EOFError("Download ended after {} of {} bytes".format(done, total))
+
+		if executable:
+			os.chmod(temp, os.stat(temp).st_mode | stat.S_IXUSR)
+		os.replace(temp, out_file)
+	except BaseException:
+		try:
+			os.remove(temp)
+		except OSError:
+			pass
+		raise
+
+	if progress:
+		progress(done, total)
+	return h.hexdigest()
@@ -0,0 +1,142 @@
+# DreamMaker Language Client - Sublime package for DreamMaker Language Server
+# Copyright (C) 2019  Tad Hardesty
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Timing of the package's entry points. Handlers wrapped with `timed` record
+# their duration when "performanceStats" is enabled, and any of them can be
+# run under cProfile on its next call.
+
+import os
+import time
+import functools
+import threading
+
+from collections import deque
+
+from . import cache_path, get_config
+
+
+SAMPLES = 1000  # kept per handler, for percentiles
+
+clock = time.perf_counter
+lock = threading.Lock()
+handlers = []
+samples = {}
+calls = {}
+imports = {}
+profile_next = set()
+
+
+def enabled():
+	return get_config('performanceStats', False)
+
+
+def record(name, seconds):
+	with lock:
+		try:
+			recent = samples[name]
+		except KeyError:
+			recent = samples[name] = deque(maxlen=SAMPLES)
+		recent.append(seconds)
+		calls[name] = calls.get(name, 0) + 1
+
+
+def timed(name):
+	def decorator(fn):
+		handlers.append(name)
+
+		@functools.wraps(fn)
+		def wrapper(*args, **kwargs):
+			if name in profile_next:
+				return profile(name, fn, args, kwargs)
+			if not enabled():
+				return fn(*args, **kwargs)
+			start = clock()
+			try:
+				return fn(*args, **kwargs)
+			finally:
+				record(name, clock() - start)
+		return wrapper
+	return decorator
+
+
+# Modules call the returned function once they have finished importing.
+def import_timer(module):
+	start = clock()
+
+	def done():
+		imports[module.rpartition('.')[2]] = clock() - start
+	return done
+
+
+def profile(name, fn, args, kwargs):
+	import cProfile
+	import io
+	import pstats
+
+	profile_next.discard(name)
+	prof = cProfile.Profile()
+	try:
+		return prof.runcall(fn, *args, **kwargs)
+	finally:
+		path = os.path.join(cache_path(), 'profiles', '{}-{}.prof'.format(
+			name, time.strftime('%Y%m%d-%H%M%S')))
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		prof.dump_stats(path)
+
+		out = io.StringIO()
+		pstats.Stats(prof, stream=out).sort_stats('cumulative').print_stats(20)
+		print('dreammaker: profile of {} written to {}'.format(name, path))
+		print(out.getvalue())
+
+
+def percentile(ordered, p):
+	index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))
+	return ordered[index]
+
+
+def report():
+	lines = []
+	if imports:
+		lines.append("Import time")
+		for module, seconds in sorted(imports.items(), key=lambda kv: -kv[1]):
+			lines.append("  {:<24} {:>9.1f} ms".format(module, seconds * 1000))
+		lines.append("")
+
+	with lock:
+		snapshot = [(name, sorted(recent), calls[name]) for name, recent in samples.items()]
+	if not snapshot:
+		if not enabled():
+			lines.append('Handler timings are off. Set "performanceStats": true to record them.')
+		else:
+			lines.append("No handlers have run yet.")
+		return "\n".join(lines)
+
+	lines.append("{:<32} {:>7} {:>9} {:>9} {:>9} {:>9}".format(
+		"Handler (ms)", "calls", "p50", "p90", "p99", "max"))
+	for name, ordered, count in sorted(snapshot):
+		lines.append("{:<32} {:>7} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+			name, count,
+			percentile(ordered, 50) * 1000,
+			percentile(ordered, 90) * 1000,
+			percentile(ordered, 99) * 1000,
+			ordered[-1] * 1000))
+	return "\n".join(lines)
+
+
+def reset():
+	with lock:
+		samples.clear()
+		calls.clear()